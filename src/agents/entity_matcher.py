@@ -0,0 +1,158 @@
+import re
+import zlib
+from typing import Any, Dict, List, Tuple
+import numpy as np
+
+_TOKEN_RE = re.compile(r"[a-z]+")
+
+DEFAULT_DIMENSIONS = 1024
+
+
+def _entity_features(entity: Dict[str, Any]) -> List[str]:
+    """
+    Turn an entity into hashed-vector features.
+    Names contribute their words only (so 'man_1' and 'man_2' look alike),
+    attributes contribute keyed words, bare words and character trigrams.
+    """
+    features = []
+
+    for word in _TOKEN_RE.findall(str(entity.get("name", "")).lower()):
+        features.append(f"n:{word}")
+    for word in _TOKEN_RE.findall(str(entity.get("type", "")).lower()):
+        features.append(f"t:{word}")
+
+    for key, value in (entity.get("attributes") or {}).items():
+        key = str(key).lower()
+        for word in _TOKEN_RE.findall(str(value).lower()):
+            features.append(f"a:{key}:{word}")
+            features.append(f"w:{word}")
+            for i in range(len(word) - 2):
+                features.append(f"g:{word[i:i + 3]}")
+
+    return features
+
+
+def _block_key(entity: Dict[str, Any]) -> str:
+    """Entities are only compared within the same broad type."""
+    words = _TOKEN_RE.findall(str(entity.get("type", "")).lower())
+    return words[0] if words else "unknown"
+
+
+class _Block:
+    def __init__(self, dimensions: int):
+        self.vectors = np.zeros((16, dimensions), dtype=np.float32)
+        self.last_seen = np.full(16, -1, dtype=np.int64)
+        self.entity_ids: List[str] = []
+
+    def append(self, entity_id: str, vector: np.ndarray, frame_index: int) -> int:
+        row = len(self.entity_ids)
+        if row == len(self.vectors):
+            self.vectors = np.vstack([self.vectors, np.zeros_like(self.vectors)])
+            self.last_seen = np.concatenate(
+                [self.last_seen, np.full(len(self.last_seen), -1, dtype=np.int64)]
+            )
+        self.vectors[row] = vector
+        self.last_seen[row] = frame_index
+        self.entity_ids.append(entity_id)
+        return row
+
+
+class EntityIndex:
+    """
+    Blocked nearest-neighbour index over hashed n-gram TF-IDF vectors of
+    entity attributes. Only entities of the same broad type that were seen
+    within the last `active_window` frames are candidates for a query.
+    """
+
+    def __init__(self, dimensions: int = DEFAULT_DIMENSIONS, active_window: int = 5):
+        self.dimensions = dimensions
+        self.active_window = active_window
+        self._blocks: Dict[str, _Block] = {}
+        self._locations: Dict[str, Tuple[str, int]] = {}
+        self._document_frequency = np.zeros(dimensions, dtype=np.float32)
+
+    def __len__(self) -> int:
+        return len(self._locations)
+
+    def embed(self, entity: Dict[str, Any]) -> np.ndarray:
+        """Sublinear term-frequency vector of the entity's hashed features."""
+        buckets = [
+            zlib.crc32(feature.encode("utf-8")) % self.dimensions
+            for feature in _entity_features(entity)
+        ]
+        counts = np.bincount(buckets, minlength=self.dimensions).astype(np.float32)
+        return np.log1p(counts)
+
+    def _idf(self) -> np.ndarray:
+        total = len(self._locations)
+        return np.log((1.0 + total) / (1.0 + self._document_frequency)) + 1.0
+
+    def query(
+        self,
+        entity: Dict[str, Any],
+        frame_index: int,
+        k: int = 5,
+        include_inactive: bool = False,
+    ) -> List[Tuple[str, float]]:
+        """
+        Return up to k (entity_id, cosine similarity) pairs, best first.
+        `include_inactive` also considers entities not seen within the
+        active window.
+        """
+        block = self._blocks.get(_block_key(entity))
+        if block is None or not block.entity_ids:
+            return []
+
+        size = len(block.entity_ids)
+        if include_inactive:
+            active = np.arange(size)
+        else:
+            active = np.nonzero(
+                block.last_seen[:size] >= frame_index - self.active_window
+            )[0]
+        if active.size == 0:
+            return []
+
+        idf = self._idf()
+        query_vector = self.embed(entity) * idf
+        query_norm = np.linalg.norm(query_vector)
+        if query_norm == 0:
+            return []
+
+        candidates = block.vectors[active] * idf
+        norms = np.linalg.norm(candidates, axis=1)
+        norms[norms == 0] = 1.0
+        scores = candidates @ query_vector / (norms * query_norm)
+
+        k = min(k, scores.size)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(block.entity_ids[active[i]], float(scores[i])) for i in top]
+
+    def similarity(self, entity_id: str, entity: Dict[str, Any]) -> float:
+        """Cosine similarity between a tracked entity and a new appearance, in any block."""
+        key, row = self._locations[entity_id]
+        idf = self._idf()
+        tracked = self._blocks[key].vectors[row] * idf
+        query_vector = self.embed(entity) * idf
+        norm = np.linalg.norm(tracked) * np.linalg.norm(query_vector)
+        return float(tracked @ query_vector / norm) if norm else 0.0
+
+    def add(self, entity_id: str, entity: Dict[str, Any], frame_index: int) -> None:
+        """Track a new entity from its first appearance."""
+        key = _block_key(entity)
+        block = self._blocks.setdefault(key, _Block(self.dimensions))
+        vector = self.embed(entity)
+        row = block.append(entity_id, vector, frame_index)
+        self._locations[entity_id] = (key, row)
+        self._document_frequency += vector > 0
+
+    def update(self, entity_id: str, entity: Dict[str, Any], frame_index: int) -> None:
+        """Replace a tracked entity's vector with its latest appearance."""
+        key, row = self._locations[entity_id]
+        block = self._blocks[key]
+        vector = self.embed(entity)
+        self._document_frequency -= block.vectors[row] > 0
+        self._document_frequency += vector > 0
+        block.vectors[row] = vector
+        block.last_seen[row] = frame_index
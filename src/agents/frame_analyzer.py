@@ -1,13 +1,16 @@
-import os
-import json
-from typing import Dict, Any
+import asyncio
 import base64
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple, Union
+from PIL import Image
 from langchain_openai import ChatOpenAI
-from langchain_core.messages import HumanMessage
+from langchain_core.messages import HumanMessage, SystemMessage
 from models.states import GraphState
-from models.data_models import FrameMetadata, Perspectives
+from models.data_models import FrameFile, FrameMetadata, Perspectives
 from config.environment import openai_api_key
-from utils import get_file_timestamp
+from utils import log_token_usage, manifest_from_paths
 from config.logging_config import get_logger
 from dotenv import load_dotenv
 
@@ -15,14 +18,207 @@ load_dotenv()
 
 logger = get_logger(__name__)
 
+# Static instructions go first and the image last so that every frame request
+# shares an identical prefix that the provider can cache. Bump the version
+# whenever the text changes. OpenAI only caches prefixes of 1024+ tokens and
+# this prompt plus the Perspectives tool schema is well below that, so frame
+# calls do not get cache hits yet (see `benchmark.py prompt-cache`).
+FRAME_PROMPT_VERSION = "frame-analysis/1"
+FRAME_SYSTEM_PROMPT = (
+    "You are an expert visual scene analyzer. "
+    "Your task is to examine this single frame and return structured information "
+    "following the provided schema. "
+    "Output MUST be compatible with the Perspectives model.\n\n"
+    "Requirements:\n"
+    "1. Provide a concise but detailed `scene_description` of the entire image.\n"
+    "2. List all visible `entities`. For each entity:\n"
+    "   - `name`: Use a short, consistent identifier (e.g., 'man_1', 'dog_1').\n"
+    "   - `type`: Broad category (person, animal, object, location, etc.).\n"
+    "   - `attributes`: Dictionary with rich details (color, clothing, position in frame, action, size, emotion, etc.).\n"
+    "3. Only include what is clearly visible. Do not speculate.\n"
+    "4. Distinguish between multiple similar entities (e.g., two people, cars).\n"
+    "5. This output will later be linked across frames to build a narrative, so consistency matters."
+)
+
+_MIME_TYPES = {
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".png": "image/png",
+    ".gif": "image/gif",
+    ".webp": "image/webp",
+}
+
 def _parse_fallback_response(response_content: str) -> Dict[str, Any]:
     """Fallback parser for malformed JSON responses."""
     logger.warning("Using fallback response parser due to malformed JSON")
     return {"scene_description": "Scene analysis completed", "entities": []}
 
+def _prepare_payload(image_path: str, max_side: int) -> Tuple[str, str]:
+    """
+    Read an image and turn it into an upload-ready (mime type, base64) pair.
+    Runs in a worker process or thread. Images are only decoded when they need to be
+    downscaled to `max_side` or are in a format the API does not accept
+    (BMP, TIFF), which is re-encoded as PNG; otherwise the file bytes are
+    encoded as-is.
+    """
+    with open(image_path, "rb") as image_file:
+        data = image_file.read()
+    mime_type = _MIME_TYPES.get(os.path.splitext(image_path)[1].lower())
+
+    if max_side > 0 or mime_type is None:
+        with Image.open(io.BytesIO(data)) as image:
+            buffer = io.BytesIO()
+            if max_side > 0 and max(image.size) > max_side:
+                image.thumbnail((max_side, max_side))
+                image.convert("RGB").save(buffer, format="JPEG", quality=85)
+                mime_type = "image/jpeg"
+            elif mime_type is None:
+                if image.mode not in ("1", "L", "LA", "P", "RGB", "RGBA"):
+                    image = image.convert("RGB")
+                image.save(buffer, format="PNG")
+                mime_type = "image/png"
+            if buffer.tell():
+                data = buffer.getvalue()
+
+    return mime_type, base64.b64encode(data).decode("ascii")
+
+def _needs_decoding(frames: List[FrameFile], max_side: int) -> bool:
+    """Whether preparing payloads involves decoding images, not just reading files."""
+    return max_side > 0 or any(
+        os.path.splitext(frame.path)[1].lower() not in _MIME_TYPES for frame in frames
+    )
+
+async def _analyze_frame(
+    structured_llm: Any,
+    frame_id: str,
+    frame: FrameFile,
+    payload: Union[Tuple[str, str], BaseException],
+    image_detail: str,
+) -> FrameMetadata:
+    """Send one prepared frame to the vision model and build its metadata."""
+    try:
+        if isinstance(payload, BaseException):
+            raise payload
+        mime_type, image_base64 = payload
+
+        messages = [
+            SystemMessage(content=FRAME_SYSTEM_PROMPT),
+            HumanMessage(
+                content=[
+                    {
+                        "type": "image_url",
+                        "image_url": {
+                            "url": f"data:{mime_type};base64,{image_base64}",
+                            "detail": image_detail,
+                        },
+                    },
+                ]
+            ),
+        ]
+
+        result = await structured_llm.ainvoke(messages)
+        log_token_usage(f"Frame {frame_id}", FRAME_PROMPT_VERSION, result["raw"])
+
+        # Parse the response
+        if result["parsed"] is not None:
+            analysis = result["parsed"].model_dump()
+        else:
+            # Fallback parsing if the structured output is malformed
+            logger.warning(f"Structured output error for frame {frame_id}, using fallback parser")
+            analysis = _parse_fallback_response(result["raw"].content)
+
+        # Convert entities to dictionaries for consistency
+        entities_list = analysis.get("entities", [])
+        entities_dicts = []
+        for entity in entities_list:
+            if hasattr(entity, "model_dump"):
+                entities_dicts.append(entity.model_dump())
+            else:
+                entities_dicts.append(entity)
+
+        logger.info("Successfully analyzed frame %s with %d entities", frame_id, len(entities_dicts))
+        return FrameMetadata(
+            frame_id=frame_id,
+            timestamp=frame.timestamp,
+            scene_description=analysis.get(
+                "scene_description", "Scene analysis unavailable"
+            ),
+            entities=entities_dicts,
+        )
+
+    except Exception as e:
+        logger.error(f"Error analyzing frame {frame_id}: {str(e)}")
+        return FrameMetadata(
+            frame_id=frame_id,
+            timestamp=frame.timestamp,
+            scene_description="Error analyzing frame",
+            entities=[],
+        )
+
+async def _run_pipeline(
+    frames: List[FrameFile], structured_llm: Any, image_detail: str
+) -> List[FrameMetadata]:
+    """
+    Two-stage pipeline: a process pool prepares image payloads while async
+    workers send them to the model. A prepared payload waits in a bounded
+    queue, and CPU workers hold their slot until the queue accepts their
+    result, so at most FRAME_CPU_WORKERS + FRAME_QUEUE_SIZE payloads are held
+    in memory at once. Without any decoding to do, threads replace the
+    process pool.
+    """
+    cpu_workers = int(os.getenv("FRAME_CPU_WORKERS", str(os.cpu_count() or 1)))
+    io_workers = max(1, int(os.getenv("FRAME_IO_WORKERS", "4")))
+    queue_size = max(1, int(os.getenv("FRAME_QUEUE_SIZE", "8")))
+    max_side = int(os.getenv("IMAGE_MAX_SIDE", "0"))
+
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+    results: List[Optional[FrameMetadata]] = [None] * len(frames)
+
+    # Payloads are prepared on the default thread pool when FRAME_CPU_WORKERS=0
+    # or when no image needs decoding, since reading and base64 are cheap
+    cpu_workers = min(cpu_workers, len(frames))
+    use_processes = cpu_workers > 0 and _needs_decoding(frames, max_side)
+    pool = ProcessPoolExecutor(max_workers=cpu_workers) if use_processes else None
+    slots = asyncio.Semaphore(cpu_workers or 1)
+
+    async def prepare(index: int, frame: FrameFile) -> None:
+        async with slots:
+            try:
+                payload = await loop.run_in_executor(
+                    pool, _prepare_payload, frame.path, max_side
+                )
+            except Exception as e:
+                payload = e
+            await queue.put((index, frame, payload))
+
+    async def produce() -> None:
+        await asyncio.gather(*(prepare(i, frame) for i, frame in enumerate(frames)))
+        for _ in range(io_workers):
+            await queue.put(None)
+
+    async def consume() -> None:
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            index, frame, payload = item
+            frame_id = f"frame_{index+1:03d}.jpg"
+            logger.info("Analyzing frame %d/%d: %s", index + 1, len(frames), frame_id)
+            results[index] = await _analyze_frame(
+                structured_llm, frame_id, frame, payload, image_detail
+            )
+
+    try:
+        await asyncio.gather(produce(), *(consume() for _ in range(io_workers)))
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    return results
+
 def analyze_frames(state: GraphState):
     logger.info("Starting Frame Analysis...")
-    frame_metadata_list = []
 
     openai_model = os.getenv("OPENAI_MODEL_FRAME")
     if not openai_model:
@@ -34,90 +230,17 @@ def analyze_frames(state: GraphState):
     llm = ChatOpenAI(
         model=openai_model, api_key=openai_api_key, temperature=temperature
     )
+    structured_llm = llm.with_structured_output(
+        Perspectives, method="function_calling", include_raw=True
+    )
 
-    for i, image_path in enumerate(state["image_paths"]):
-        frame_id = f"frame_{i+1:03d}.jpg"
-
-        logger.info(f"Analyzing frame {i+1}/{len(state['image_paths'])}: {frame_id}")
-
-        # Analyze the frame
-        try:
-            # Load and encode image to Base64
-            with open(image_path, "rb") as image_file:
-                image_base64 = base64.b64encode(image_file.read()).decode("utf-8")
-
-            message = HumanMessage(
-                content=[
-                    {
-                        "type": "text",
-                        "text": (
-                            "You are an expert visual scene analyzer. "
-                            "Your task is to examine this single frame and return structured information "
-                            "following the provided schema. "
-                            "Output MUST be compatible with the Perspectives model.\n\n"
-                            "Requirements:\n"
-                            "1. Provide a concise but detailed `scene_description` of the entire image.\n"
-                            "2. List all visible `entities`. For each entity:\n"
-                            "   - `name`: Use a short, consistent identifier (e.g., 'man_1', 'dog_1').\n"
-                            "   - `type`: Broad category (person, animal, object, location, etc.).\n"
-                            "   - `attributes`: Dictionary with rich details (color, clothing, position in frame, action, size, emotion, etc.).\n"
-                            "3. Only include what is clearly visible. Do not speculate.\n"
-                            "4. Distinguish between multiple similar entities (e.g., two people, cars).\n"
-                            "5. This output will later be linked across frames to build a narrative, so consistency matters."
-                        ),
-                    },
-                    {
-                        "type": "image_url",
-                        "image_url": {"url": f"data:image/jpeg;base64,{image_base64}"},
-                    },
-                ]
-            )
-
-            structured_llm = llm.with_structured_output(
-                Perspectives, method="function_calling"
-            )
-
-            result: Perspectives = structured_llm.invoke([message])
-
-            # Parse the response
-            try:
-                analysis = result.model_dump()
-            except json.JSONDecodeError:
-                # Fallback parsing if JSON is malformed
-                logger.warning(f"JSON decode error for frame {frame_id}, using fallback parser")
-                analysis = _parse_fallback_response(result.content)
-
-            # Convert entities to dictionaries for consistency
-            entities_list = analysis.get("entities", [])
-            entities_dicts = []
-            for entity in entities_list:
-                if hasattr(entity, "model_dump"):
-                    entities_dicts.append(entity.model_dump())
-                else:
-                    entities_dicts.append(entity)
-
-            frame_metadata = FrameMetadata(
-                frame_id=frame_id,
-                timestamp=get_file_timestamp(image_path),
-                scene_description=analysis.get(
-                    "scene_description", "Scene analysis unavailable"
-                ),
-                entities=entities_dicts,
-            )
-
-            frame_metadata_list.append(frame_metadata)
-            logger.info(f"Successfully analyzed frame {frame_id} with {len(entities_dicts)} entities")
-
-        except Exception as e:
-            logger.error(f"Error analyzing frame {frame_id}: {str(e)}")
+    manifest = state.get("frame_manifest") or manifest_from_paths(state["image_paths"])
+    run_plan = state.get("run_plan")
+    image_detail = run_plan.image_detail if run_plan else "auto"
 
-            frame_metadata = FrameMetadata(
-                frame_id=frame_id,
-                timestamp=get_file_timestamp(image_path),
-                scene_description="Error analyzing frame",
-                entities=[],
-            )
-            frame_metadata_list.append(frame_metadata)
+    frame_metadata_list = asyncio.run(
+        _run_pipeline(manifest.frames, structured_llm, image_detail)
+    )
 
     logger.info(f"Frame analysis completed. Processed {len(frame_metadata_list)} frames")
     return {"frame_metadata": frame_metadata_list}
@@ -2,9 +2,9 @@ import json
 import os
 from typing import Any, Dict, List
 from dotenv import load_dotenv
-from langchain_core.messages import HumanMessage
+from langchain_core.messages import HumanMessage, SystemMessage
 from langchain_openai import ChatOpenAI
-from utils import clean_json_text
+from utils import clean_json_text, log_token_usage
 from config.environment import openai_api_key
 from models.states import GraphState
 from config.logging_config import get_logger
@@ -13,20 +13,10 @@ load_dotenv()
 
 logger = get_logger(__name__)
 
-def _build_prompt(consistent_entities: Dict[str, Any]) -> str:
-    characters = consistent_entities.get("characters", [])
-    events = consistent_entities.get("events", [])
-
-    context = {
-        "characters": characters,
-        "events": events,
-    }
-
-    return f"""
-You are a skilled story editor. Using the linked characters and chronological events, synthesize a coherent story.
-
-Context (JSON):
-{json.dumps(context, indent=2)}
+# Versioned static prefix; _build_prompt supplies the trailing user message.
+STORY_PROMPT_VERSION = "story-synthesis/1"
+STORY_SYSTEM_PROMPT = """
+You are a skilled story editor. Using the linked characters and chronological events provided by the user as JSON context, synthesize a coherent story.
 
 Tasks:
 1) Create a short, descriptive Title for the story.
@@ -35,18 +25,76 @@ Tasks:
 4) Build the event sequence using each event's frame_id and a clear event_description based on the event text.
 
 Output ONLY a valid JSON object in this exact schema:
-{{
+{
   "title": "string",
   "summary": "string (2-3 sentences)",
   "main_characters": [
-    {{"character_id": "string", "description": "string"}}
+    {"character_id": "string", "description": "string"}
   ],
   "event_sequence": [
-    {{"frame_id": "string", "event_description": "string"}}
+    {"frame_id": "string", "event_description": "string"}
+  ]
+}
+"""
+
+# Sectioned mode: event descriptions are written per chunk of events, then a
+# short final call names and summarizes the story from the chunk outputs.
+SECTION_PROMPT_VERSION = "story-section/1"
+SECTION_SYSTEM_PROMPT = """
+You are a skilled story editor. The user provides the story's characters and one consecutive section of its chronological events as JSON context.
+
+Task: write a clear, engaging event_description for every event in the section, in order, using each event's frame_id. Keep character references consistent with the character list.
+
+Output ONLY a valid JSON object in this exact schema:
+{
+  "event_sequence": [
+    {"frame_id": "string", "event_description": "string"}
+  ]
+}
+"""
+
+OUTLINE_PROMPT_VERSION = "story-outline/1"
+OUTLINE_SYSTEM_PROMPT = """
+You are a skilled story editor. The user provides the story's characters and its complete, already written event sequence as JSON context.
+
+Tasks:
+1) Create a short, descriptive Title for the story.
+2) Write a concise 2-3 sentence Summary of the full sequence.
+3) Produce a simplified list of main characters (2-5 max). Use the character's existing description. Each item must use keys: character_id (entity_id), description.
+
+Output ONLY a valid JSON object in this exact schema:
+{
+  "title": "string",
+  "summary": "string (2-3 sentences)",
+  "main_characters": [
+    {"character_id": "string", "description": "string"}
   ]
-}}
+}
+"""
+
+def _build_prompt(consistent_entities: Dict[str, Any]) -> str:
+    """Build the variable part of the synthesis request; it follows STORY_SYSTEM_PROMPT."""
+    characters = consistent_entities.get("characters", [])
+    events = consistent_entities.get("events", [])
+
+    context = {
+        "characters": characters,
+        "events": events,
+    }
+
+    return f"""Context (JSON):
+{json.dumps(context, indent=2)}
 """
 
+def _fallback_event_sequence(events: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+    return [
+        {
+            "frame_id": ev.get("frame_id", "frame_000.jpg"),
+            "event_description": ev.get("event", "An event occurs."),
+        }
+        for ev in events
+    ]
+
 def _fallback_synthesis(consistent_entities: Dict[str, Any]) -> Dict[str, Any]:
     characters: List[Dict[str, Any]] = consistent_entities.get("characters", [])
     events: List[Dict[str, Any]] = consistent_entities.get("events", [])
@@ -71,14 +119,7 @@ def _fallback_synthesis(consistent_entities: Dict[str, Any]) -> Dict[str, Any]:
         )
 
     # Event sequence
-    event_sequence = []
-    for ev in events:
-        event_sequence.append(
-            {
-                "frame_id": ev.get("frame_id", "frame_000.jpg"),
-                "event_description": ev.get("event", "An event occurs."),
-            }
-        )
+    event_sequence = _fallback_event_sequence(events)
 
     # Summary
     if events:
@@ -100,6 +141,92 @@ def _fallback_synthesis(consistent_entities: Dict[str, Any]) -> Dict[str, Any]:
         "event_sequence": event_sequence,
     }
 
+def _parse_section(response: Any, events: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+    """
+    Parse one section's event_sequence, or raise ValueError if it is unusable.
+    Frame ids always come from the section's own events, in order.
+    """
+    parsed = json.loads(clean_json_text(response.content))
+    sequence = parsed.get("event_sequence") if isinstance(parsed, dict) else None
+    if not isinstance(sequence, list) or len(sequence) != len(events):
+        raise ValueError("section event_sequence does not match its events")
+
+    section = []
+    for event, item in zip(events, sequence):
+        description = item.get("event_description") if isinstance(item, dict) else None
+        if not isinstance(description, str) or not description.strip():
+            raise ValueError("section entry is missing an event_description")
+        section.append(
+            {
+                "frame_id": event.get("frame_id", "frame_000.jpg"),
+                "event_description": description,
+            }
+        )
+    return section
+
+def _synthesize_sectioned(
+    llm: ChatOpenAI, consistent_entities: Dict[str, Any], section_size: int
+) -> Dict[str, Any]:
+    """
+    Write event descriptions for chunks of events concurrently, then ask for
+    the title, summary and main characters. A failed chunk falls back to its
+    heuristic event text; a failed final call falls back to _fallback_synthesis
+    for those fields only.
+    """
+    characters = consistent_entities.get("characters", [])
+    events = consistent_entities.get("events", [])
+    sections = [events[i:i + section_size] for i in range(0, len(events), section_size)]
+    max_concurrency = int(os.getenv("STORY_SECTION_CONCURRENCY", "4"))
+
+    logger.info(f"Synthesizing {len(events)} events in {len(sections)} sections")
+    requests = [
+        [
+            SystemMessage(content=SECTION_SYSTEM_PROMPT),
+            HumanMessage(
+                content=f"""Context (JSON):
+{json.dumps({"characters": characters, "events": section}, indent=2)}
+"""
+            ),
+        ]
+        for section in sections
+    ]
+    responses = llm.batch(
+        requests, config={"max_concurrency": max_concurrency}, return_exceptions=True
+    )
+
+    event_sequence = []
+    for i, (section, response) in enumerate(zip(sections, responses)):
+        try:
+            if isinstance(response, Exception):
+                raise response
+            log_token_usage(f"Story section {i+1}", SECTION_PROMPT_VERSION, response)
+            event_sequence.extend(_parse_section(response, section))
+        except Exception as e:
+            logger.warning(f"Story section {i+1}/{len(sections)} failed: {str(e)}. Falling back for this section.")
+            event_sequence.extend(_fallback_event_sequence(section))
+
+    try:
+        response = llm.invoke(
+            [
+                SystemMessage(content=OUTLINE_SYSTEM_PROMPT),
+                HumanMessage(
+                    content=f"""Context (JSON):
+{json.dumps({"characters": characters, "event_sequence": event_sequence}, indent=2)}
+"""
+                ),
+            ]
+        )
+        log_token_usage("Story outline", OUTLINE_PROMPT_VERSION, response)
+        story = json.loads(clean_json_text(response.content))
+        if not isinstance(story, dict):
+            raise ValueError("outline response is not a JSON object")
+    except Exception as e:
+        logger.warning(f"Story outline failed: {str(e)}. Falling back for title and summary.")
+        story = _fallback_synthesis(consistent_entities)
+
+    story["event_sequence"] = event_sequence
+    return story
+
 def synthesize_story(state: GraphState) -> Dict[str, Any]:
     """Final node: synthesize a complete story JSON from consistent entities and events."""
     logger.info("Starting Story Synthesis...")
@@ -117,6 +244,12 @@ def synthesize_story(state: GraphState) -> Dict[str, Any]:
         }
         return {"final_story": json.dumps(minimal, ensure_ascii=False)}
 
+    run_plan = state.get("run_plan")
+    if run_plan and not run_plan.use_llm_synthesis:
+        logger.info("Run plan skips LLM synthesis; using fallback synthesis.")
+        synthesized = _fallback_synthesis(consistent_entities)
+        return {"final_story": json.dumps(synthesized, ensure_ascii=False)}
+
     openai_model = os.getenv("OPENAI_MODEL_STORY")
     if not openai_model:
         logger.warning("OPENAI_MODEL_STORY not set; using fallback synthesis.")
@@ -125,20 +258,33 @@ def synthesize_story(state: GraphState) -> Dict[str, Any]:
 
     temperature = float(os.getenv("TEMPERATURE_STORY", "0.6"))
 
+    # "auto" sections only stories with more events than fit in one section
+    mode = os.getenv("STORY_SYNTHESIS_MODE", "auto").lower()
+    section_size = max(1, int(os.getenv("STORY_SECTION_SIZE", "8")))
+    event_count = len(consistent_entities.get("events", []))
+    sectioned = mode == "sectioned" or (mode == "auto" and event_count > section_size)
+
     try:
         llm = ChatOpenAI(
             model=openai_model, api_key=openai_api_key, temperature=temperature
         )
-        prompt = _build_prompt(consistent_entities)
-        response = llm.invoke([HumanMessage(content=prompt)])
 
-        try:
-            cleaned = clean_json_text(response.content)
-            story = json.loads(cleaned)
-            logger.info("Successfully synthesized story using LLM")
-        except json.JSONDecodeError:
-            logger.warning("Story Synthesizer: JSON decode failed. Falling back.")
-            story = _fallback_synthesis(consistent_entities)
+        if sectioned:
+            story = _synthesize_sectioned(llm, consistent_entities, section_size)
+        else:
+            prompt = _build_prompt(consistent_entities)
+            response = llm.invoke(
+                [SystemMessage(content=STORY_SYSTEM_PROMPT), HumanMessage(content=prompt)]
+            )
+            log_token_usage("Story synthesizer", STORY_PROMPT_VERSION, response)
+
+            try:
+                cleaned = clean_json_text(response.content)
+                story = json.loads(cleaned)
+                logger.info("Successfully synthesized story using LLM")
+            except json.JSONDecodeError:
+                logger.warning("Story Synthesizer: JSON decode failed. Falling back.")
+                story = _fallback_synthesis(consistent_entities)
     except Exception as e:
         logger.error(f"Story Synthesizer error: {str(e)}. Falling back.")
         story = _fallback_synthesis(consistent_entities)
@@ -1,19 +1,62 @@
 import json
+from itertools import combinations
 from typing import Dict, Any, List, Tuple
 from langchain_openai import ChatOpenAI
-from langchain_core.messages import HumanMessage
+from langchain_core.messages import HumanMessage, SystemMessage
 from models.states import GraphState
 from models.data_models import FrameMetadata, Entity, ConsistentEntity, Event
+from agents.entity_matcher import EntityIndex
 from config.environment import openai_api_key
 import os
 from dotenv import load_dotenv
-from utils import clean_json_text
+from utils import clean_json_text, log_token_usage
 from config.logging_config import get_logger
 
 load_dotenv()
 
 logger = get_logger(__name__)
 
+# Versioned static prefix; the frame data follows in the user message.
+LINKER_PROMPT_VERSION = "temporal-linker/1"
+LINKER_SYSTEM_PROMPT = """
+You are an expert story analyst. Analyze the frame sequence provided by the user and create a detailed narrative with enhanced entity tracking and event extraction.
+
+The user message contains the frame data, the current entity tracking and the current events.
+
+Your task is to:
+1. **Enhance Character Descriptions**: Provide detailed characteristics, personality traits, and roles for each entity
+2. **Improve Event Narratives**: Create more engaging and detailed event descriptions that tell a story
+3. **Identify Interactions**: Detect relationships and interactions between entities across frames
+4. **Add Context**: Provide significance and meaning to each event in the overall narrative
+
+Focus on creating a cohesive story that flows naturally from frame to frame.
+
+IMPORTANT: You must respond with ONLY a valid JSON object. Do not include any other text.
+
+Use this exact JSON structure:
+{
+    "characters": [
+        {
+            "entity_id": "animal_1",
+            "description": "A black crow with glossy feathers, intelligent eyes, and a distinctive caw",
+            "characteristics": ["intelligent", "opportunistic", "resourceful"],
+            "role": "protagonist seeking food"
+        }
+    ],
+    "events": [
+        {
+            "frame_id": "frame_001.jpg",
+            "timestamp": "2025-08-05T14:00:46Z",
+            "event": "The crow takes flight from a tree branch, clutching a piece of bread in its beak",
+            "entities_involved": ["animal_1"],
+            "significance": "Establishes the crow as the main character and shows its resourcefulness"
+        }
+    ]
+}
+
+Ensure all entity_ids match those from the current entity tracking.
+"""
+
 
 def _calculate_similarity(entity1: Dict[str, Any], entity2: Dict[str, Any]) -> float:
     """
@@ -58,11 +101,125 @@ def _calculate_similarity(entity1: Dict[str, Any], entity2: Dict[str, Any]) -> f
     return score
 
 
+def _new_consistent_entity(
+    entity: Dict[str, Any],
+    frame_id: str,
+    consistent_entities: Dict[str, ConsistentEntity],
+    entity_counter: Dict[str, int],
+) -> str:
+    """Register a newly seen entity under the next ID for its type."""
+    entity_type = entity["type"].lower()
+    if entity_type not in entity_counter:
+        entity_counter[entity_type] = 0
+    entity_counter[entity_type] += 1
+
+    entity_id = f"{entity_type}_{entity_counter[entity_type]}"
+
+    consistent_entities[entity_id] = ConsistentEntity(
+        entity_id=entity_id,
+        description=entity["name"],
+        first_seen=frame_id,
+        entity_type=entity["type"],
+    )
+    consistent_entities[entity_id].appearances.append(frame_id)
+    logger.debug("Created new entity %s: %s", entity_id, entity["name"])
+    return entity_id
+
+
 def _resolve_entities(
     frame_metadata_list: List[FrameMetadata],
 ) -> Dict[str, ConsistentEntity]:
     """
     Resolve entities across frames and assign consistent IDs.
+    The matcher is chosen with ENTITY_MATCHER: 'embedding' (default) or 'name'.
+    Each entity dict in the frame metadata is annotated with its `entity_id`.
+    """
+    matcher = os.getenv("ENTITY_MATCHER", "embedding").lower()
+    if matcher == "name":
+        return _resolve_entities_by_name(frame_metadata_list)
+    return _resolve_entities_by_embedding(frame_metadata_list)
+
+
+def _resolve_entities_by_embedding(
+    frame_metadata_list: List[FrameMetadata],
+) -> Dict[str, ConsistentEntity]:
+    """
+    Resolve entities with a top-k query against an attribute-embedding index
+    of recently active entities of the same type. The vision model often
+    keeps an entity's name stable while its attributes and even its type
+    drift, so the entity last seen under the same name is always a candidate
+    (in any block, however long ago) and gets ENTITY_NAME_BONUS, which by
+    default is enough to clear the threshold. If no candidate matches, the
+    entities outside the active window are queried before creating a new ID.
+    """
+    logger.info("Starting entity resolution across frames (embedding matcher)")
+    consistent_entities = {}
+    entity_counter = {}
+    named = {}
+
+    threshold = float(os.getenv("ENTITY_MATCH_THRESHOLD", "0.5"))
+    name_bonus = float(os.getenv("ENTITY_NAME_BONUS", "0.5"))
+    top_k = int(os.getenv("ENTITY_MATCH_TOP_K", "5"))
+    index = EntityIndex(active_window=int(os.getenv("ENTITY_ACTIVE_WINDOW", "5")))
+
+    def best_candidate(candidates, name, claimed):
+        best_match = None
+        best_score = threshold
+        for entity_id, score in candidates:
+            if entity_id in claimed:
+                continue
+            if named.get(name) == entity_id:
+                score += name_bonus
+            if score >= best_score:
+                best_score = score
+                best_match = entity_id
+        return best_match
+
+    for frame_index, frame_meta in enumerate(frame_metadata_list):
+        frame_id = frame_meta["frame_id"]
+        claimed = set()
+
+        for entity in frame_meta["entities"]:
+            name = entity["name"].lower()
+            candidates = index.query(entity, frame_index, k=top_k)
+            same_name = named.get(name)
+            if same_name and same_name not in dict(candidates):
+                candidates.append((same_name, index.similarity(same_name, entity)))
+
+            best_match = best_candidate(candidates, name, claimed)
+            if not best_match:
+                # An entity returning after longer than the active window
+                best_match = best_candidate(
+                    index.query(entity, frame_index, k=top_k, include_inactive=True),
+                    name,
+                    claimed,
+                )
+
+            if best_match:
+                if frame_id not in consistent_entities[best_match].appearances:
+                    consistent_entities[best_match].appearances.append(frame_id)
+                    logger.debug("Updated entity %s with frame %s", best_match, frame_id)
+                index.update(best_match, entity, frame_index)
+            else:
+                best_match = _new_consistent_entity(
+                    entity, frame_id, consistent_entities, entity_counter
+                )
+                index.add(best_match, entity, frame_index)
+
+            claimed.add(best_match)
+            named[name] = best_match
+            entity["entity_id"] = best_match
+
+    logger.info(f"Entity resolution completed. Found {len(consistent_entities)} unique entities")
+    return consistent_entities
+
+
+def _resolve_entities_by_name(
+    frame_metadata_list: List[FrameMetadata],
+) -> Dict[str, ConsistentEntity]:
+    """
+    Resolve entities by exact name, then by similarity to a same-named entity
+    in the previous appearance's frame.
     """
     logger.info("Starting entity resolution across frames")
     consistent_entities = {}
@@ -119,58 +276,94 @@ def _resolve_entities(
                     consistent_entities[best_match].appearances.append(
                         frame_meta["frame_id"]
                     )
-                    logger.debug(f"Updated entity {best_match} with frame {frame_meta['frame_id']}")
+                    logger.debug("Updated entity %s with frame %s", best_match, frame_meta["frame_id"])
             else:
-                # Create new entity
-                entity_type = entity["type"].lower()
-                if entity_type not in entity_counter:
-                    entity_counter[entity_type] = 0
-                entity_counter[entity_type] += 1
-
-                entity_id = f"{entity_type}_{entity_counter[entity_type]}"
-
-                consistent_entities[entity_id] = ConsistentEntity(
-                    entity_id=entity_id,
-                    description=entity["name"],
-                    first_seen=frame_meta["frame_id"],
-                    entity_type=entity["type"],
+                best_match = _new_consistent_entity(
+                    entity, frame_meta["frame_id"], consistent_entities, entity_counter
                 )
-                consistent_entities[entity_id].appearances.append(
-                    frame_meta["frame_id"]
-                )
-                logger.debug(f"Created new entity {entity_id}: {entity['name']}")
+
+            entity["entity_id"] = best_match
 
     logger.info(f"Entity resolution completed. Found {len(consistent_entities)} unique entities")
     return consistent_entities
 
 
+def _build_frame_index(
+    frame_metadata_list: List[FrameMetadata],
+    consistent_entities: Dict[str, ConsistentEntity],
+) -> Tuple[Dict[str, List[str]], Dict[str, List[str]]]:
+    """
+    Build per-frame lookups from the resolved entities in a single pass.
+    Returns (introduced, present): frame_id -> entity_ids first seen in that
+    frame, and frame_id -> entity_ids visible in that frame.
+    """
+    introduced = {meta["frame_id"]: [] for meta in frame_metadata_list}
+    present = {meta["frame_id"]: [] for meta in frame_metadata_list}
+
+    for entity_id, consistent_entity in consistent_entities.items():
+        if consistent_entity.first_seen in introduced:
+            introduced[consistent_entity.first_seen].append(entity_id)
+        for frame_id in consistent_entity.appearances:
+            if frame_id in present:
+                present[frame_id].append(entity_id)
+
+    return introduced, present
+
+
 def _extract_events(
     frame_metadata_list: List[FrameMetadata],
     consistent_entities: Dict[str, ConsistentEntity],
 ) -> List[Event]:
     """
     Extract key events from the frame sequence.
+    Entrances, returns, exits and first-time pairings of entities
+    are derived from the frame index in one pass over the frames.
     """
     logger.info("Starting event extraction from frame sequence")
     events = []
 
-    for i, frame_meta in enumerate(frame_metadata_list):
-        # Create a summary of what's happening in this frame
+    introduced, present = _build_frame_index(frame_metadata_list, consistent_entities)
+    previous_present: List[str] = []
+    seen_pairs = set()
+
+    for frame_meta in frame_metadata_list:
+        frame_id = frame_meta["frame_id"]
         frame_entities = [e["name"] for e in frame_meta["entities"]]
 
-        # Determine if this frame introduces new entities or shows interactions
-        new_entities = []
-        for entity in frame_meta["entities"]:
-            for entity_id, consistent_entity in consistent_entities.items():
-                if (
-                    entity["name"].lower() == consistent_entity.description.lower()
-                    and frame_meta["frame_id"] == consistent_entity.first_seen
-                ):
-                    new_entities.append(entity_id)
+        new_entities = introduced.get(frame_id, [])
+        current_present = present.get(frame_id, [])
+        current_set = set(current_present)
+        previous_set = set(previous_present)
+
+        returning = [
+            eid
+            for eid in current_present
+            if eid not in previous_set and eid not in new_entities
+        ]
+        exiting = [eid for eid in previous_present if eid not in current_set]
+        # Only pairings never seen before, and not ones an entrance already implies
+        new_pairings = [
+            pair
+            for pair in combinations(current_present, 2)
+            if frozenset(pair) not in seen_pairs
+            and pair[0] not in new_entities
+            and pair[1] not in new_entities
+        ]
+        seen_pairs.update(frozenset(pair) for pair in combinations(current_present, 2))
 
         # Generate event description
+        parts = []
         if new_entities:
-            event_desc = f"{', '.join(new_entities)} enter the scene."
+            parts.append(f"{', '.join(new_entities)} enter the scene.")
+        if returning:
+            parts.append(f"{', '.join(returning)} return to the scene.")
+        if exiting:
+            parts.append(f"{', '.join(exiting)} leave the scene.")
+        for first, second in new_pairings:
+            parts.append(f"{first} and {second} appear together for the first time.")
+
+        if parts:
+            event_desc = " ".join(parts)
         elif len(frame_entities) > 1:
             event_desc = f"Multiple entities ({', '.join(frame_entities)}) are present in the scene."
         else:
@@ -180,16 +373,29 @@ def _extract_events(
 
         events.append(
             Event(
-                frame_id=frame_meta["frame_id"],
+                frame_id=frame_id,
                 timestamp=frame_meta["timestamp"],
                 event=event_desc,
+                entities_involved=current_present + exiting,
             )
         )
+        previous_present = current_present
 
     logger.info(f"Event extraction completed. Found {len(events)} events")
     return events
 
 
+def _heuristic_analysis(
+    consistent_entities: Dict[str, ConsistentEntity],
+    events: List[Event],
+) -> Dict[str, Any]:
+    """Resolved entities and heuristic events in the enhanced-analysis shape."""
+    return {
+        "characters": [v.model_dump() for v in consistent_entities.values()],
+        "events": [e.model_dump() for e in events],
+    }
+
+
 def _enhance_with_llm_analysis(
     frame_metadata_list: List[FrameMetadata],
     consistent_entities: Dict[str, ConsistentEntity],
@@ -228,51 +434,20 @@ def _enhance_with_llm_analysis(
         "events": [e.model_dump() for e in events],
     }
 
-    prompt = f"""
-    You are an expert story analyst. Analyze the following frame sequence and create a detailed narrative with enhanced entity tracking and event extraction.
-    
-    Frame Data: {json.dumps(context['frames'], indent=2)}
-    
-    Current Entity Tracking: {json.dumps(context['consistent_entities'], indent=2)}
-    Current Events: {json.dumps(context['events'], indent=2)}
-    
-    Your task is to:
-    1. **Enhance Character Descriptions**: Provide detailed characteristics, personality traits, and roles for each entity
-    2. **Improve Event Narratives**: Create more engaging and detailed event descriptions that tell a story
-    3. **Identify Interactions**: Detect relationships and interactions between entities across frames
-    4. **Add Context**: Provide significance and meaning to each event in the overall narrative
-    
-    Focus on creating a cohesive story that flows naturally from frame to frame.
-    
-    IMPORTANT: You must respond with ONLY a valid JSON object. Do not include any other text.
-    
-    Use this exact JSON structure:
-    {{
-        "characters": [
-            {{
-                "entity_id": "animal_1",
-                "description": "A black crow with glossy feathers, intelligent eyes, and a distinctive caw",
-                "characteristics": ["intelligent", "opportunistic", "resourceful"],
-                "role": "protagonist seeking food"
-            }}
-        ],
-        "events": [
-            {{
-                "frame_id": "frame_001.jpg",
-                "timestamp": "2025-08-05T14:00:46Z",
-                "event": "The crow takes flight from a tree branch, clutching a piece of bread in its beak",
-                "entities_involved": ["animal_1"],
-                "significance": "Establishes the crow as the main character and shows its resourcefulness"
-            }}
-        ]
-    }}
-    
-    Ensure all entity_ids match those from the current entity tracking.
-    """
+    # Variable data goes last so the static instructions stay cacheable
+    payload = f"""Frame Data: {json.dumps(context['frames'], indent=2)}
+
+Current Entity Tracking: {json.dumps(context['consistent_entities'], indent=2)}
+Current Events: {json.dumps(context['events'], indent=2)}
+"""
 
     try:
-        message = HumanMessage(content=prompt)
-        response = llm.invoke([message])
+        messages = [
+            SystemMessage(content=LINKER_SYSTEM_PROMPT),
+            HumanMessage(content=payload),
+        ]
+        response = llm.invoke(messages)
+        log_token_usage("Temporal linker", LINKER_PROMPT_VERSION, response)
 
         # Parse the response
         try:
@@ -288,17 +463,11 @@ def _enhance_with_llm_analysis(
             logger.error(f"JSON parsing error: {e}")
             logger.error(f"Raw response: {response.content[:500]}...")
             # Fallback to original analysis
-            return {
-                "characters": [v.model_dump() for v in consistent_entities.values()],
-                "events": [e.model_dump() for e in events],
-            }
+            return _heuristic_analysis(consistent_entities, events)
     except Exception as e:
         logger.error(f"Error in LLM enhancement: {str(e)}")
         # Fallback to original analysis
-        return {
-            "characters": [v.model_dump() for v in consistent_entities.values()],
-            "events": [e.model_dump() for e in events],
-        }
+        return _heuristic_analysis(consistent_entities, events)
 
 
 def link_temporal_entities(state: GraphState) -> Dict[str, Any]:
@@ -322,11 +491,16 @@ def link_temporal_entities(state: GraphState) -> Dict[str, Any]:
     logger.info("Extracting events from frame sequence...")
     events = _extract_events(frame_metadata_list, consistent_entities)
 
-    # Step 3: Enhance with LLM analysis
-    logger.info("Enhancing analysis with LLM...")
-    enhanced_analysis = _enhance_with_llm_analysis(
-        frame_metadata_list, consistent_entities, events
-    )
+    # Step 3: Enhance with LLM analysis, unless the run plan dropped it
+    run_plan = state.get("run_plan")
+    if run_plan and not run_plan.use_llm_enhancement:
+        logger.info("Run plan skips LLM enhancement; using heuristic events")
+        enhanced_analysis = _heuristic_analysis(consistent_entities, events)
+    else:
+        logger.info("Enhancing analysis with LLM...")
+        enhanced_analysis = _enhance_with_llm_analysis(
+            frame_metadata_list, consistent_entities, events
+        )
 
     logger.info(
         f"Temporal Entity Linking completed. Found {len(enhanced_analysis['characters'])} characters and {len(enhanced_analysis['events'])} events."
@@ -0,0 +1,528 @@
+"""
+Offline benchmarks for the pipeline's local (non-LLM) stages.
+
+Run from the repository root:
+    python src/benchmark.py entity-matching --frames 100 --identities 500
+
+Entity matching at thousands of tracked entities (~1,000 and ~2,200 IDs):
+    python src/benchmark.py entity-matching --frames 200 --identities 3000 --per-frame 50
+    python src/benchmark.py entity-matching --frames 400 --identities 10000 --per-frame 100
+    python src/benchmark.py logging --records 20000
+    python src/benchmark.py prompt-cache
+"""
+import argparse
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Tuple
+from unittest import mock
+
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+
+from agents.temporal_entity_linker import (  # noqa: E402
+    _resolve_entities_by_embedding,
+    _resolve_entities_by_name,
+)
+from config.logging_config import get_logger, setup_logging, shutdown_logging  # noqa: E402
+from models.data_models import FrameMetadata  # noqa: E402
+from langchain_core.messages import AIMessage, BaseMessage, SystemMessage  # noqa: E402
+from PIL import Image  # noqa: E402
+from agents import frame_analyzer, story_synthesizer, temporal_entity_linker  # noqa: E402
+from agents.frame_analyzer import FRAME_PROMPT_VERSION, FRAME_SYSTEM_PROMPT  # noqa: E402
+from agents.temporal_entity_linker import LINKER_PROMPT_VERSION, LINKER_SYSTEM_PROMPT  # noqa: E402
+from agents.story_synthesizer import (  # noqa: E402
+    OUTLINE_PROMPT_VERSION,
+    OUTLINE_SYSTEM_PROMPT,
+    SECTION_PROMPT_VERSION,
+    SECTION_SYSTEM_PROMPT,
+    STORY_PROMPT_VERSION,
+    STORY_SYSTEM_PROMPT,
+)
+from planner import _text_tokens  # noqa: E402
+from utils import get_token_usage  # noqa: E402
+
+_ALIASES = {
+    "person": ["man", "woman", "person", "figure", "pedestrian"],
+    "animal": ["dog", "animal", "pet", "hound"],
+    "vehicle": ["car", "vehicle", "sedan", "automobile"],
+}
+_COLORS = ["red", "blue", "green", "black", "white", "yellow", "brown", "grey"]
+_ITEMS = ["jacket", "hat", "scarf", "backpack", "collar", "stripe", "roof", "boots"]
+_SIZES = ["small", "medium", "large"]
+_POSITIONS = ["left", "right", "center", "background", "foreground"]
+_ACTIONS = ["walking", "standing", "running", "sitting", "turning", "waiting"]
+
+
+def _synthetic_frames(
+    frames: int, identities: int, per_frame: int, seed: int
+) -> Tuple[List[FrameMetadata], List[List[int]]]:
+    """
+    Build frames of entities whose names drift between frames while their
+    stable attributes stay put. Returns the frames and the true identity of
+    every entity, in the same order.
+    """
+    rng = random.Random(seed)
+    people = []
+    for _ in range(identities):
+        entity_type = rng.choice(list(_ALIASES))
+        people.append(
+            {
+                "type": entity_type,
+                "color": f"{rng.choice(_COLORS)} {rng.choice(_ITEMS)}",
+                "detail": f"{rng.choice(_COLORS)} {rng.choice(_ITEMS)}",
+                "size": rng.choice(_SIZES),
+            }
+        )
+
+    # Each identity stays on screen for a stretch of consecutive frames.
+    active = rng.sample(range(identities), min(per_frame, identities))
+    next_identity = len(active)
+
+    frame_list, truth = [], []
+    for i in range(frames):
+        if i and next_identity < identities:
+            for slot in range(len(active)):
+                if rng.random() < 0.2 and next_identity < identities:
+                    active[slot] = next_identity
+                    next_identity += 1
+
+        entities, frame_truth = [], []
+        for identity in active:
+            person = people[identity]
+            attributes = {
+                "color": person["color"],
+                "size": person["size"],
+                "position": rng.choice(_POSITIONS),
+                "action": rng.choice(_ACTIONS),
+            }
+            if rng.random() < 0.7:
+                attributes["detail"] = person["detail"]
+            entities.append(
+                {
+                    "name": f"{rng.choice(_ALIASES[person['type']])}_{rng.randint(1, 3)}",
+                    "type": person["type"],
+                    "attributes": attributes,
+                }
+            )
+            frame_truth.append(identity)
+
+        frame_list.append(
+            FrameMetadata(
+                frame_id=f"frame_{i+1:03d}.jpg",
+                timestamp="2025-01-01T00:00:00Z",
+                scene_description="Synthetic frame",
+                entities=entities,
+            )
+        )
+        truth.append(frame_truth)
+
+    return frame_list, truth
+
+
+def _stable_name_frames(
+    frames: int, identities: int, per_frame: int, seed: int
+) -> Tuple[List[FrameMetadata], List[List[int]]]:
+    """
+    Build frames where every identity keeps its name (as the vision model
+    usually does) but its free-text attributes drift: actions and positions
+    change, the type sometimes switches to an alias, some appearances have
+    no attributes, and identities leave and come back after longer than the
+    active window.
+    """
+    rng = random.Random(seed)
+    counters: Dict[str, int] = {}
+    people = []
+    for _ in range(identities):
+        entity_type = rng.choice(list(_ALIASES))
+        noun = rng.choice(_ALIASES[entity_type])
+        counters[noun] = counters.get(noun, 0) + 1
+        people.append({"type": entity_type, "name": f"{noun}_{counters[noun]}"})
+
+    frame_list, truth = [], []
+    for i in range(frames):
+        # Identities drift in and out; anyone may reappear after a long gap
+        frame_truth = rng.sample(range(identities), min(per_frame, identities))
+        entities = []
+        for identity in frame_truth:
+            person = people[identity]
+            attributes = {}
+            if rng.random() < 0.8:
+                attributes = {
+                    "description": f"{rng.choice(_SIZES)} {rng.choice(_COLORS)} {rng.choice(_ITEMS)}",
+                    "position": rng.choice(_POSITIONS),
+                    "action": rng.choice(_ACTIONS),
+                }
+            entity_type = person["type"]
+            if rng.random() < 0.2:
+                entity_type = rng.choice(_ALIASES[entity_type])
+            entities.append(
+                {"name": person["name"], "type": entity_type, "attributes": attributes}
+            )
+
+        frame_list.append(
+            FrameMetadata(
+                frame_id=f"frame_{i+1:03d}.jpg",
+                timestamp="2025-01-01T00:00:00Z",
+                scene_description="Synthetic frame",
+                entities=entities,
+            )
+        )
+        truth.append(frame_truth)
+
+    return frame_list, truth
+
+
+def _score(frames: List[FrameMetadata], truth: List[List[int]]) -> Dict[str, float]:
+    """
+    Re-identification: share of consecutive sightings of an identity that kept
+    the same ID. Collisions: share of same-frame pairs of distinct identities
+    that were given the same ID.
+    """
+    last_id: Dict[int, str] = {}
+    kept = total = collisions = pairs = 0
+
+    for frame, frame_truth in zip(frames, truth):
+        assigned = [e["entity_id"] for e in frame["entities"]]
+        for identity, entity_id in zip(frame_truth, assigned):
+            if identity in last_id:
+                total += 1
+                kept += last_id[identity] == entity_id
+            last_id[identity] = entity_id
+        for a in range(len(assigned)):
+            for b in range(a + 1, len(assigned)):
+                if frame_truth[a] != frame_truth[b]:
+                    pairs += 1
+                    collisions += assigned[a] == assigned[b]
+
+    return {
+        "reid": kept / total if total else 0.0,
+        "collisions": collisions / pairs if pairs else 0.0,
+    }
+
+
+def bench_entity_matching(args: argparse.Namespace) -> None:
+    """
+    Run both matchers on two synthetic stories: names that drift while
+    attributes stay put, and stable names with drifting attributes.
+    """
+    matchers = {
+        "name": _resolve_entities_by_name,
+        "embedding": _resolve_entities_by_embedding,
+    }
+    scenarios = {
+        "drifting names": _synthetic_frames,
+        "stable names": _stable_name_frames,
+    }
+    print(
+        f"entity matching: {args.frames} frames, {args.identities} identities, "
+        f"{args.per_frame} entities per frame"
+    )
+    for scenario, build_frames in scenarios.items():
+        print(f" {scenario}:")
+        for label, resolve in matchers.items():
+            frames, truth = build_frames(
+                args.frames, args.identities, args.per_frame, args.seed
+            )
+            start = time.perf_counter()
+            consistent_entities = resolve(frames)
+            elapsed = time.perf_counter() - start
+            scores = _score(frames, truth)
+            print(
+                f"  {label:<10} {elapsed / args.frames * 1000:8.2f} ms/frame  "
+                f"ids={len(consistent_entities):<6} reid={scores['reid']:.3f}  "
+                f"collisions={scores['collisions']:.3f}"
+            )
+
+
+def bench_logging(args: argparse.Namespace) -> None:
+    """
+    Caller-side cost per record for each logging mode, plus the time to drain
+    the queue at shutdown. Console output is discarded; the file is real.
+    """
+    modes = {
+        "sync text": dict(use_queue=False, json_format=False),
+        "queue text": dict(use_queue=True, json_format=False),
+        "queue json": dict(use_queue=True, json_format=True),
+        "queue json 10%": dict(
+            use_queue=True,
+            json_format=True,
+            sample_rates={"story_generator.benchmark": 0.1},
+        ),
+    }
+    payload = {"entity": "person_1", "frame": "frame_001.jpg"}
+    print(f"logging: {args.records} records per mode")
+
+    stderr = sys.stderr
+    with tempfile.TemporaryDirectory() as tmp, open(os.devnull, "w") as devnull:
+        for label, options in modes.items():
+            sys.stderr = devnull
+            try:
+                setup_logging("INFO", os.path.join(tmp, "bench.log"), **options)
+                logger = get_logger("benchmark")
+
+                start = time.perf_counter()
+                for i in range(args.records):
+                    logger.info("Updated entity %s with frame %s (%d)", payload["entity"], payload["frame"], i)
+                emit = time.perf_counter() - start
+
+                start = time.perf_counter()
+                shutdown_logging()
+                drain = time.perf_counter() - start
+            finally:
+                sys.stderr = stderr
+            print(
+                f"  {label:<15} {emit / args.records * 1e6:7.2f} us/record  "
+                f"drain={drain * 1000:8.1f} ms"
+            )
+
+    # Disabled DEBUG calls: eager f-string vs. deferred %-formatting
+    logger = get_logger("benchmark")
+    logger.setLevel(logging.INFO)
+    start = time.perf_counter()
+    for i in range(args.records):
+        logger.debug(f"Updated entity {payload['entity']} with frame {payload['frame']} ({i})")
+    eager = time.perf_counter() - start
+    start = time.perf_counter()
+    for i in range(args.records):
+        logger.debug("Updated entity %s with frame %s (%d)", payload["entity"], payload["frame"], i)
+    lazy = time.perf_counter() - start
+    print(
+        f"  disabled debug  f-string {eager / args.records * 1e6:.2f} us/call, "
+        f"lazy {lazy / args.records * 1e6:.2f} us/call"
+    )
+
+
+# A story prompt long enough to be cached, to exercise the cache-hit path
+_LONG_STORY_PROMPT = STORY_SYSTEM_PROMPT * 8
+
+
+class _EchoUsageModel:
+    """
+    Local stand-in for ChatOpenAI that records every request and echoes
+    OpenAI-style usage for it. Like OpenAI, it reports as cached the longest
+    run of leading messages shared with an earlier request, but only once
+    that prefix reaches 1024 tokens, counted in 128-token steps.
+    """
+
+    MIN_CACHEABLE_TOKENS = 1024
+
+    def __init__(self, raw_usage: bool = False):
+        self.raw_usage = raw_usage
+        self.requests: List[List[BaseMessage]] = []
+        self.responses: List[AIMessage] = []
+        # Leading messages each request shared with an earlier one
+        self.shared_prefixes: List[int] = []
+
+    def __call__(self, *args, **kwargs) -> "_EchoUsageModel":
+        # Replaces the ChatOpenAI class, so every construction gets this model
+        return self
+
+    def _shared_prefix(self, messages: List[BaseMessage]) -> int:
+        """Number of leading messages this request shares with an earlier one."""
+        longest = 0
+        for earlier in self.requests:
+            shared = 0
+            for a, b in zip(earlier, messages):
+                if (a.type, a.content) != (b.type, b.content):
+                    break
+                shared += 1
+            longest = max(longest, shared)
+        return longest
+
+    def invoke(self, messages: List[BaseMessage], *args, **kwargs) -> AIMessage:
+        shared = self._shared_prefix(messages)
+        prefix_tokens = sum(_text_tokens(str(m.content)) for m in messages[:shared])
+        input_tokens = sum(_text_tokens(str(m.content)) for m in messages)
+        self.requests.append(list(messages))
+        self.shared_prefixes.append(shared)
+
+        cached = 0
+        if prefix_tokens >= self.MIN_CACHEABLE_TOKENS:
+            cached = prefix_tokens - (prefix_tokens - self.MIN_CACHEABLE_TOKENS) % 128
+
+        if self.raw_usage:
+            # Shape of older integrations that only pass the OpenAI usage block
+            response = AIMessage(
+                content="{}",
+                response_metadata={
+                    "token_usage": {
+                        "prompt_tokens": input_tokens,
+                        "completion_tokens": 1,
+                        "prompt_tokens_details": {"cached_tokens": cached},
+                    }
+                },
+            )
+        else:
+            response = AIMessage(
+                content="{}",
+                usage_metadata={
+                    "input_tokens": input_tokens,
+                    "output_tokens": 1,
+                    "total_tokens": input_tokens + 1,
+                    "input_token_details": {"cache_read": cached},
+                },
+            )
+        self.responses.append(response)
+        return response
+
+    def batch(self, requests, *args, **kwargs) -> List[AIMessage]:
+        return [self.invoke(messages) for messages in requests]
+
+    def with_structured_output(self, schema, **kwargs) -> "_EchoUsageModel":
+        return self
+
+    async def ainvoke(self, messages: List[BaseMessage], *args, **kwargs) -> Dict[str, Any]:
+        return {"raw": self.invoke(messages), "parsed": None}
+
+
+def _run_call_sites(model: _EchoUsageModel, image_dir: str) -> None:
+    """Drive the real LLM call sites with the echo model, twice each with different data."""
+    frames = [
+        FrameMetadata(
+            frame_id=f"frame_{i+1:03d}.jpg",
+            timestamp="2025-01-01T00:00:00Z",
+            scene_description=f"Scene {i}",
+            entities=[{"name": f"dog_{i}", "type": "animal", "attributes": {}}],
+        )
+        for i in range(2)
+    ]
+    consistent_entities = {
+        "characters": [{"entity_id": "animal_1", "description": "dog", "appearances": []}],
+        "events": [
+            {"frame_id": f"frame_{i+1:03d}.jpg", "event": f"The dog does thing {i}"}
+            for i in range(3)
+        ],
+    }
+
+    with mock.patch.object(frame_analyzer, "ChatOpenAI", model), mock.patch.object(
+        temporal_entity_linker, "ChatOpenAI", model
+    ), mock.patch.object(story_synthesizer, "ChatOpenAI", model):
+        frame_analyzer.analyze_frames(
+            {"image_paths": sorted(os.path.join(image_dir, name) for name in os.listdir(image_dir))}
+        )
+        for frame in frames:
+            temporal_entity_linker._enhance_with_llm_analysis([frame], {}, [])
+        for mode in ("single", "sectioned"):
+            with mock.patch.dict(os.environ, {"STORY_SYNTHESIS_MODE": mode, "STORY_SECTION_SIZE": "2"}):
+                for events in (consistent_entities["events"], consistent_entities["events"][::-1]):
+                    story_synthesizer.synthesize_story(
+                        {"consistent_entities": dict(consistent_entities, events=events)}
+                    )
+        with mock.patch.object(
+            story_synthesizer, "STORY_SYSTEM_PROMPT", _LONG_STORY_PROMPT
+        ), mock.patch.dict(os.environ, {"STORY_SYNTHESIS_MODE": "single"}):
+            for events in (consistent_entities["events"], consistent_entities["events"][::-1]):
+                story_synthesizer.synthesize_story(
+                    {"consistent_entities": dict(consistent_entities, events=events)}
+                )
+
+
+def bench_prompt_cache(args: argparse.Namespace) -> None:
+    """
+    Run each stage's real call site twice with different data through the
+    echo stub, check that the requests share exactly their system prompt
+    (so variable data comes strictly after the static prefix), and report
+    the cached/uncached split from get_token_usage.
+    """
+    prompts = {
+        "frame": (FRAME_PROMPT_VERSION, FRAME_SYSTEM_PROMPT),
+        "linker": (LINKER_PROMPT_VERSION, LINKER_SYSTEM_PROMPT),
+        "story": (STORY_PROMPT_VERSION, STORY_SYSTEM_PROMPT),
+        "story section": (SECTION_PROMPT_VERSION, SECTION_SYSTEM_PROMPT),
+        "story outline": (OUTLINE_PROMPT_VERSION, OUTLINE_SYSTEM_PROMPT),
+        "long prefix": (STORY_PROMPT_VERSION, _LONG_STORY_PROMPT),
+    }
+    print("prompt cache (real call sites, echo stub, ~4 characters per token):")
+
+    splits = {}
+    with tempfile.TemporaryDirectory() as image_dir, mock.patch.dict(
+        os.environ,
+        {
+            "OPENAI_MODEL_FRAME": "echo",
+            "OPENAI_MODEL_TEMP": "echo",
+            "OPENAI_MODEL_STORY": "echo",
+            "IMAGE_MAX_SIDE": "0",
+        },
+    ):
+        for i in range(2):
+            Image.new("RGB", (64, 64), (i * 120, 0, 0)).save(
+                os.path.join(image_dir, f"frame_{i}.jpg")
+            )
+
+        for raw_usage in (False, True):
+            model = _EchoUsageModel(raw_usage=raw_usage)
+            # The call sites warn about the stub's empty answers; only usage matters here
+            logging.disable(logging.WARNING)
+            try:
+                _run_call_sites(model, image_dir)
+            finally:
+                logging.disable(logging.NOTSET)
+            for label, (version, prefix) in prompts.items():
+                calls = [
+                    (request, response, shared)
+                    for request, response, shared in zip(
+                        model.requests, model.responses, model.shared_prefixes
+                    )
+                    if request[0].content == prefix
+                ]
+                assert len(calls) >= 2, f"{label}: expected repeated calls, got {len(calls)}"
+                for request, _, _ in calls:
+                    assert isinstance(request[0], SystemMessage), f"{label}: prefix is not a system message"
+                    assert all(
+                        not isinstance(m, SystemMessage) and m.content != prefix
+                        for m in request[1:]
+                    ), f"{label}: static text after the payload"
+                assert calls[-1][2] == 1, (
+                    f"{label}: requests with different data share more or less than the system prompt"
+                )
+                splits[(raw_usage, label)] = get_token_usage(calls[-1][1])
+
+    for label, (version, prefix) in prompts.items():
+        usage = splits[(False, label)]
+        assert usage == splits[(True, label)], f"{label}: usage shapes disagree"
+        assert (
+            usage["cached_input_tokens"] + usage["uncached_input_tokens"]
+            == usage["input_tokens"]
+        ), label
+
+        prefix_tokens = _text_tokens(prefix)
+        cacheable = prefix_tokens >= _EchoUsageModel.MIN_CACHEABLE_TOKENS
+        assert (usage["cached_input_tokens"] > 0) == cacheable, label
+        assert usage["cached_input_tokens"] <= prefix_tokens, label
+        print(
+            f"  {label:<14} {version:<20} prefix ~{prefix_tokens:>5} tokens "
+            f"({'cacheable' if cacheable else 'below 1024, never cached'})  "
+            f"input={usage['input_tokens']} cached={usage['cached_input_tokens']} "
+            f"uncached={usage['uncached_input_tokens']}"
+        )
+    print("  every call site shares exactly its system prompt across requests")
+    print("  usage_metadata and raw token_usage shapes report the same split")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    matching = subparsers.add_parser("entity-matching")
+    matching.add_argument("--frames", type=int, default=100)
+    matching.add_argument("--identities", type=int, default=500)
+    matching.add_argument("--per-frame", type=int, default=20)
+    matching.add_argument("--seed", type=int, default=7)
+    matching.set_defaults(run=bench_entity_matching)
+
+    logs = subparsers.add_parser("logging")
+    logs.add_argument("--records", type=int, default=20000)
+    logs.set_defaults(run=bench_logging)
+
+    cache = subparsers.add_parser("prompt-cache")
+    cache.set_defaults(run=bench_prompt_cache)
+
+    args = parser.parse_args()
+    args.run(args)
+
+
+if __name__ == "__main__":
+    main()
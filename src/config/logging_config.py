@@ -1,9 +1,132 @@
+import atexit
+import copy
+import json
 import logging
+import logging.handlers
 import os
+import queue
+import threading
+from typing import Dict, Optional
 
+_queue_listener: Optional[logging.handlers.QueueListener] = None
 
-def setup_logging(log_level: str = "INFO", log_file: str = None) -> logging.Logger:
-    """Set up logging configuration for the application."""
+# Attributes every LogRecord has; anything else came from `extra=`
+_STANDARD_RECORD_ATTRS = set(
+    vars(logging.LogRecord("", logging.INFO, "", 0, "", None, None))
+) | {"message", "asctime", "taskName"}
+
+_IMMUTABLE_ARG_TYPES = (str, int, float, bool, bytes, type(None))
+
+
+class JsonFormatter(logging.Formatter):
+    """Format records as one JSON object per line."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "time": self.formatTime(record, self.datefmt),
+            "logger": record.name,
+            "level": record.levelname,
+            "message": record.getMessage(),
+            "thread": record.threadName,
+        }
+        for key, value in vars(record).items():
+            if key not in _STANDARD_RECORD_ATTRS and key not in payload:
+                payload[key] = value
+        if record.exc_info:
+            payload["exception"] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keep only a fraction of records below WARNING for the configured loggers
+    (and their children). Sampling is deterministic: with a rate of 0.1 every
+    tenth record is kept.
+    """
+
+    def __init__(self, sample_rates: Dict[str, float]):
+        super().__init__()
+        self.sample_rates = sample_rates
+        self._counts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def _rate_for(self, name: str) -> Optional[str]:
+        for prefix in sorted(self.sample_rates, key=len, reverse=True):
+            if name == prefix or name.startswith(prefix + "."):
+                return prefix
+        return None
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        prefix = self._rate_for(record.name)
+        if prefix is None:
+            return True
+
+        rate = self.sample_rates[prefix]
+        with self._lock:
+            count = self._counts.get(prefix, 0) + 1
+            self._counts[prefix] = count
+        return int(count * rate) != int((count - 1) * rate)
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue records without formatting them; the listener thread formats.
+    Records whose args are not all immutable scalars have their message
+    rendered now, so later changes to a logged dict or list are not seen.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        args = record.args
+        if args and not (
+            isinstance(args, tuple)
+            and all(isinstance(arg, _IMMUTABLE_ARG_TYPES) for arg in args)
+        ):
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+
+def _parse_sample_rates(value: str) -> Dict[str, float]:
+    """Parse 'logger=rate,logger=rate' into a mapping."""
+    sample_rates = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        name, _, rate = item.partition("=")
+        sample_rates[name.strip()] = float(rate)
+    return sample_rates
+
+
+def shutdown_logging() -> None:
+    """Flush and stop the background logging thread, if one is running."""
+    global _queue_listener
+    if _queue_listener is not None:
+        _queue_listener.stop()
+        _queue_listener = None
+
+
+def setup_logging(
+    log_level: str = "INFO",
+    log_file: str = None,
+    use_queue: bool = None,
+    json_format: bool = None,
+    sample_rates: Dict[str, float] = None,
+) -> logging.Logger:
+    """
+    Set up logging configuration for the application.
+
+    use_queue hands records to a background thread that formats and writes
+    them (LOG_QUEUE=1), json_format writes one JSON object per record
+    (LOG_FORMAT=json) and sample_rates keeps only a fraction of sub-WARNING
+    records per logger (LOG_SAMPLING="story_generator.utils=0.1").
+    """
+    if use_queue is None:
+        use_queue = os.getenv("LOG_QUEUE", "0").lower() in ("1", "true", "yes")
+    if json_format is None:
+        json_format = os.getenv("LOG_FORMAT", "text").lower() == "json"
+    if sample_rates is None:
+        sample_rates = _parse_sample_rates(os.getenv("LOG_SAMPLING", ""))
 
     if log_file and not os.path.exists(os.path.dirname(log_file)):
         os.makedirs(os.path.dirname(log_file), exist_ok=True)
@@ -11,25 +134,45 @@ def setup_logging(log_level: str = "INFO", log_file: str = None) -> logging.Logg
     log_format = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
     date_format = "%Y-%m-%d %H:%M:%S"
 
+    shutdown_logging()
+
     logger = logging.getLogger("story_generator")
     logger.setLevel(getattr(logging, log_level.upper()))
 
     logger.handlers.clear()
 
+    if json_format:
+        formatter = JsonFormatter(datefmt=date_format)
+    else:
+        formatter = logging.Formatter(log_format, date_format)
+
     # Create console handler
+    handlers = []
     console_handler = logging.StreamHandler()
     console_handler.setLevel(getattr(logging, log_level.upper()))
-    console_formatter = logging.Formatter(log_format, date_format)
-    console_handler.setFormatter(console_formatter)
-    logger.addHandler(console_handler)
+    console_handler.setFormatter(formatter)
+    handlers.append(console_handler)
 
     # Create file handler if log_file is specified
     if log_file:
         file_handler = logging.FileHandler(log_file, mode="a", encoding="utf-8")
         file_handler.setLevel(getattr(logging, log_level.upper()))
-        file_formatter = logging.Formatter(log_format, date_format)
-        file_handler.setFormatter(file_formatter)
-        logger.addHandler(file_handler)
+        file_handler.setFormatter(formatter)
+        handlers.append(file_handler)
+
+    if use_queue:
+        global _queue_listener
+        queue_handler = _DeferredQueueHandler(queue.SimpleQueue())
+        _queue_listener = logging.handlers.QueueListener(
+            queue_handler.queue, *handlers, respect_handler_level=True
+        )
+        _queue_listener.start()
+        handlers = [queue_handler]
+
+    for handler in handlers:
+        if sample_rates:
+            handler.addFilter(SamplingFilter(sample_rates))
+        logger.addHandler(handler)
 
     return logger
 
@@ -40,3 +183,6 @@ def get_logger(name: str = None) -> logging.Logger:
     if name:
         return logging.getLogger(f"story_generator.{name}")
     return logging.getLogger("story_generator")
+
+
+atexit.register(shutdown_logging)
@@ -1,16 +1,53 @@
+import logging
 import os
+import sqlite3
 from langgraph.graph import StateGraph, START, END
 from langgraph.checkpoint.memory import MemorySaver
-from utils import read_images_on_folder
+from utils import scan_frames
 from models.states import GraphState
 from agents.frame_analyzer import analyze_frames
 from agents.temporal_entity_linker import link_temporal_entities
 from agents.story_synthesizer import synthesize_story
 from config.logging_config import setup_logging, get_logger
+from result_store import ResultStore
+from planner import plan_run
 
 # Set up logging
 logger = get_logger(__name__)
 
+def _log_intermediate_results(result):
+    # Display frame analysis results
+    logger.debug("=== Frame Analysis Results ===")
+    for metadata in result["frame_metadata"]:
+        logger.debug("Frame: %s", metadata["frame_id"])
+        logger.debug("Timestamp: %s", metadata["timestamp"])
+        logger.debug("Scene: %s", metadata["scene_description"])
+        logger.debug("Entities found: %d", len(metadata["entities"]))
+
+        for entity in metadata["entities"]:
+            logger.debug("  - %s: %s", entity["name"], entity["type"])
+
+    # Display temporal entity linking results
+    logger.debug("=== Temporal Entity Linking Results ===")
+    consistent_entities = result["consistent_entities"]
+
+    logger.debug("Characters (%d):", len(consistent_entities["characters"]))
+    for character in consistent_entities["characters"]:
+        logger.debug("  - %s: %s", character["entity_id"], character["description"])
+        if "characteristics" in character:
+            logger.debug("    Characteristics: %s", ", ".join(character["characteristics"]))
+        if "role" in character:
+            logger.debug("    Role: %s", character["role"])
+
+    logger.debug("Events (%d):", len(consistent_entities["events"]))
+    for event in consistent_entities["events"]:
+        logger.debug("  - Frame %s: %s", event["frame_id"], event["event"])
+        if "entities_involved" in event:
+            logger.debug("    Entities: %s", ", ".join(event["entities_involved"]))
+        if "significance" in event:
+            logger.debug("    Significance: %s", event["significance"])
+
+
 def main():
     # Set up logging configuration
     setup_logging(log_level="INFO", log_file="logs/story_generator.log")
@@ -20,28 +57,43 @@ def main():
         logger.error(f"The folder at '{folder_path}' does not exist.")
         return
 
-    image_paths = read_images_on_folder(folder_path)
-    logger.info(f"Found {len(image_paths)} images in {folder_path}")
+    manifest = scan_frames(
+        folder_path,
+        pattern=os.getenv("FRAME_GLOB") or None,
+        recursive=os.getenv("FRAME_RECURSIVE", "0").lower() in ("1", "true", "yes"),
+        order=os.getenv("FRAME_ORDER", "name").lower(),
+    )
+    logger.info(f"Found {len(manifest.frames)} images in {folder_path}")
+
+    # Bound the run by wall-clock deadline and/or token budget, if configured
+    deadline = os.getenv("RUN_DEADLINE_SECONDS")
+    token_budget = os.getenv("RUN_TOKEN_BUDGET")
+    manifest, run_plan = plan_run(
+        manifest,
+        deadline_seconds=float(deadline) if deadline else None,
+        token_budget=int(token_budget) if token_budget else None,
+    )
+    image_paths = manifest.paths
 
     workflow = StateGraph(GraphState)
     workflow.add_node(
         "analyze_frames",
         analyze_frames,
-        inputs=["image_paths"],
+        inputs=["image_paths", "frame_manifest", "run_plan"],
         outputs=["frame_metadata"],
     )
 
     workflow.add_node(
         "link_temporal_entities",
         link_temporal_entities,
-        inputs=["frame_metadata"],
+        inputs=["frame_metadata", "run_plan"],
         outputs=["consistent_entities"],
     )
 
     workflow.add_node(
         "synthesize_story",
         synthesize_story,
-        inputs=["consistent_entities"],
+        inputs=["consistent_entities", "run_plan"],
         outputs=["final_story"],
     )
 
@@ -57,42 +109,29 @@ def main():
     # Create a thread
     config = {"configurable": {"thread_id": "1"}}
 
-    result = workflow.invoke({"image_paths": image_paths}, config)
-
-    # Display frame analysis results
-    logger.debug("=== Frame Analysis Results ===")
-    for metadata in result["frame_metadata"]:
-        logger.debug(f"Frame: {metadata['frame_id']}")
-        logger.debug(f"Timestamp: {metadata['timestamp']}")
-        logger.debug(f"Scene: {metadata['scene_description']}")
-        logger.debug(f"Entities found: {len(metadata['entities'])}")
-
-        for entity in metadata["entities"]:
-            logger.debug(f"  - {entity['name']}: {entity['type']}")
-
-    # Display temporal entity linking results
-    logger.debug("=== Temporal Entity Linking Results ===")
-    consistent_entities = result["consistent_entities"]
-
-    logger.debug(f"Characters ({len(consistent_entities['characters'])}):")
-    for character in consistent_entities["characters"]:
-        logger.debug(f"  - {character['entity_id']}: {character['description']}")
-        if "characteristics" in character:
-            logger.debug(f"    Characteristics: {', '.join(character['characteristics'])}")
-        if "role" in character:
-            logger.debug(f"    Role: {character['role']}")
+    result = workflow.invoke(
+        {"image_paths": image_paths, "frame_manifest": manifest, "run_plan": run_plan},
+        config,
+    )
 
-    logger.debug(f"Events ({len(consistent_entities['events'])}):")
-    for event in consistent_entities["events"]:
-        logger.debug(f"  - Frame {event['frame_id']}: {event['event']}")
-        if "entities_involved" in event:
-            logger.debug(f"    Entities: {', '.join(event['entities_involved'])}")
-        if "significance" in event:
-            logger.debug(f"    Significance: {event['significance']}")
+    # The per-entity dumps below are only worth building when DEBUG is on
+    if logger.isEnabledFor(logging.DEBUG):
+        _log_intermediate_results(result)
 
     # Display final synthesized story
     logger.info("=== Final Story JSON ===")
     logger.info(result["final_story"])
+    if run_plan.degradations:
+        logger.info(f"Degradations applied: {', '.join(run_plan.degradations)}")
+
+    # Persist the story with its frames, entities and events for later lookup
+    store_path = os.getenv("RESULT_STORE_PATH", "results/stories.db")
+    if store_path:
+        try:
+            with ResultStore(store_path) as store:
+                store.save(result, folder=folder_path)
+        except (sqlite3.Error, OSError) as e:
+            logger.error(f"Could not store the story in {store_path}: {e}")
 
 
 if __name__ == "__main__":
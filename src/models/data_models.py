@@ -1,4 +1,5 @@
-from typing import TypedDict, List, Dict, Any, Optional
+from datetime import datetime
+from typing import TypedDict, List, Dict, Any, Optional, Tuple
 from pydantic import BaseModel, Field
 
 
@@ -36,3 +37,49 @@ class Event(BaseModel):
     frame_id: str
     timestamp: str
     event: str
+    entities_involved: List[str] = []
+
+
+class FrameFile(BaseModel):
+    path: str
+    size: int
+    mtime: float
+    capture_time: Optional[str] = None
+    # (width, height) when the image header has already been read
+    image_size: Optional[Tuple[int, int]] = None
+
+    @property
+    def timestamp(self) -> str:
+        """Capture time when known, otherwise the modification time."""
+        if self.capture_time:
+            return self.capture_time
+        return datetime.fromtimestamp(self.mtime).isoformat() + "Z"
+
+
+class FrameManifest(BaseModel):
+    folder: str
+    frames: List[FrameFile] = []
+
+    @property
+    def paths(self) -> List[str]:
+        return [frame.path for frame in self.frames]
+
+
+class StageEstimate(BaseModel):
+    calls: int
+    input_tokens: int
+    output_tokens: int
+    seconds: float
+
+
+class RunPlan(BaseModel):
+    deadline_seconds: Optional[float] = None
+    token_budget: Optional[int] = None
+    frame_count: int = 0
+    image_detail: str = "auto"
+    use_llm_enhancement: bool = True
+    use_llm_synthesis: bool = True
+    stages: Dict[str, StageEstimate] = {}
+    estimated_tokens: int = 0
+    estimated_seconds: float = 0.0
+    degradations: List[str] = []
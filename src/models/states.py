@@ -1,9 +1,11 @@
 from typing import TypedDict, List, Dict, Any, Optional
-from models.data_models import FrameMetadata
+from models.data_models import FrameMetadata, FrameManifest, RunPlan
 
 
 class GraphState(TypedDict):
     image_paths: List[str]
+    frame_manifest: Optional[FrameManifest]
+    run_plan: Optional[RunPlan]
     frame_metadata: List[FrameMetadata]
     consistent_entities: Dict[str, Any]
     final_story: str
@@ -0,0 +1,259 @@
+import math
+import os
+from typing import List, Optional, Tuple
+from PIL import Image
+from agents.frame_analyzer import FRAME_SYSTEM_PROMPT
+from agents.temporal_entity_linker import LINKER_SYSTEM_PROMPT
+from agents.story_synthesizer import (
+    OUTLINE_SYSTEM_PROMPT,
+    SECTION_SYSTEM_PROMPT,
+    STORY_SYSTEM_PROMPT,
+)
+from models.data_models import FrameFile, FrameManifest, RunPlan, StageEstimate
+from config.logging_config import get_logger
+
+logger = get_logger(__name__)
+
+# Rough per-call sizes used for estimation; tune with observed token usage logs
+FRAME_OUTPUT_TOKENS = 350
+LINKER_INPUT_TOKENS_PER_FRAME = 250
+LINKER_OUTPUT_TOKENS_PER_FRAME = 120
+STORY_OUTPUT_TOKENS_PER_FRAME = 60
+STORY_OUTPUT_TOKENS_BASE = 250
+# The linker reports roughly one event per frame
+EVENTS_PER_FRAME = 1
+DEFAULT_IMAGE_SIZE = (1024, 1024)
+
+
+def _text_tokens(text: str) -> int:
+    """Approximate token count (about four characters per token)."""
+    return len(text) // 4 + 1
+
+
+def _image_tokens(width: int, height: int, detail: str) -> int:
+    """Vision input tokens for one image, following OpenAI's tiling rules."""
+    if detail == "low":
+        return 85
+
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    tiles = math.ceil(width / 512) * math.ceil(height / 512)
+    return 85 + 170 * tiles
+
+
+def _downscaled(width: int, height: int, max_side: int) -> Tuple[int, int]:
+    """Size after the frame analyzer's IMAGE_MAX_SIDE downscaling, if any."""
+    if max_side <= 0 or max(width, height) <= max_side:
+        return width, height
+    scale = max_side / max(width, height)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def _image_size(frame: FrameFile) -> Tuple[int, int]:
+    """Image dimensions, read from the file header unless the scan already did."""
+    if frame.image_size:
+        return frame.image_size
+    try:
+        with Image.open(frame.path) as image:
+            return image.size
+    except Exception as e:
+        logger.warning(f"Could not read image size for {frame.path}: {e}. Assuming {DEFAULT_IMAGE_SIZE}.")
+        return DEFAULT_IMAGE_SIZE
+
+
+def _subsample(count: int, keep: int) -> List[int]:
+    """Evenly spaced indices, always keeping the first and last frame."""
+    if keep >= count:
+        return list(range(count))
+    if keep <= 1:
+        return [0]
+    return sorted({round(i * (count - 1) / (keep - 1)) for i in range(keep)})
+
+
+def _seconds(calls: int, input_tokens: int, output_tokens: int) -> float:
+    latency = float(os.getenv("PLANNER_CALL_LATENCY_SECONDS", "1.5"))
+    output_rate = float(os.getenv("PLANNER_OUTPUT_TOKENS_PER_SECOND", "50"))
+    input_rate = float(os.getenv("PLANNER_INPUT_TOKENS_PER_SECOND", "5000"))
+    return calls * latency + input_tokens / input_rate + output_tokens / output_rate
+
+
+def _story_estimate(events: int) -> StageEstimate:
+    """
+    Story synthesis cost, following the synthesizer's mode selection: one
+    call, or one call per STORY_SECTION_SIZE events (STORY_SECTION_CONCURRENCY
+    at a time) followed by an outline call.
+    """
+    mode = os.getenv("STORY_SYNTHESIS_MODE", "auto").lower()
+    section_size = max(1, int(os.getenv("STORY_SECTION_SIZE", "8")))
+    if not (mode == "sectioned" or (mode == "auto" and events > section_size)):
+        story_input = _text_tokens(STORY_SYSTEM_PROMPT) + events * LINKER_OUTPUT_TOKENS_PER_FRAME
+        story_output = STORY_OUTPUT_TOKENS_BASE + events * STORY_OUTPUT_TOKENS_PER_FRAME
+        return StageEstimate(
+            calls=1,
+            input_tokens=story_input,
+            output_tokens=story_output,
+            seconds=_seconds(1, story_input, story_output),
+        )
+
+    concurrency = max(1, int(os.getenv("STORY_SECTION_CONCURRENCY", "4")))
+    sections = max(1, math.ceil(events / section_size))
+    section_events = min(events, section_size)
+    section_input = _text_tokens(SECTION_SYSTEM_PROMPT) + section_events * LINKER_OUTPUT_TOKENS_PER_FRAME
+    section_output = section_events * STORY_OUTPUT_TOKENS_PER_FRAME
+    outline_input = _text_tokens(OUTLINE_SYSTEM_PROMPT) + events * STORY_OUTPUT_TOKENS_PER_FRAME
+    outline_output = STORY_OUTPUT_TOKENS_BASE
+    waves = math.ceil(sections / concurrency)
+    return StageEstimate(
+        calls=sections + 1,
+        input_tokens=sections * section_input + outline_input,
+        output_tokens=sections * section_output + outline_output,
+        seconds=waves * _seconds(1, section_input, section_output)
+        + _seconds(1, outline_input, outline_output),
+    )
+
+
+def _estimate(plan: RunPlan, image_sizes: List[Tuple[int, int]]) -> RunPlan:
+    """Fill in per-stage and total estimates for the plan's current strategy."""
+    frames = len(image_sizes)
+    stages = {}
+
+    # Frames are sent FRAME_IO_WORKERS at a time, after IMAGE_MAX_SIDE downscaling
+    max_side = int(os.getenv("IMAGE_MAX_SIDE", "0"))
+    io_workers = max(1, min(frames, int(os.getenv("FRAME_IO_WORKERS", "4"))))
+    frame_input = sum(
+        _text_tokens(FRAME_SYSTEM_PROMPT)
+        + _image_tokens(*_downscaled(w, h, max_side), plan.image_detail)
+        for w, h in image_sizes
+    )
+    frame_output = frames * FRAME_OUTPUT_TOKENS
+    stages["analyze_frames"] = StageEstimate(
+        calls=frames,
+        input_tokens=frame_input,
+        output_tokens=frame_output,
+        seconds=_seconds(frames, frame_input, frame_output) / io_workers,
+    )
+
+    if plan.use_llm_enhancement:
+        linker_input = _text_tokens(LINKER_SYSTEM_PROMPT) + frames * LINKER_INPUT_TOKENS_PER_FRAME
+        linker_output = frames * LINKER_OUTPUT_TOKENS_PER_FRAME
+        stages["link_temporal_entities"] = StageEstimate(
+            calls=1,
+            input_tokens=linker_input,
+            output_tokens=linker_output,
+            seconds=_seconds(1, linker_input, linker_output),
+        )
+
+    if plan.use_llm_synthesis:
+        stages["synthesize_story"] = _story_estimate(frames * EVENTS_PER_FRAME)
+
+    plan.frame_count = frames
+    plan.stages = stages
+    plan.estimated_tokens = sum(s.input_tokens + s.output_tokens for s in stages.values())
+    plan.estimated_seconds = sum(s.seconds for s in stages.values())
+    return plan
+
+
+def _fits(plan: RunPlan) -> bool:
+    return _overrun(plan) == 0
+
+
+def _overrun(plan: RunPlan) -> float:
+    """How far the estimates exceed the limits, as a sum of relative excesses."""
+    overrun = 0.0
+    if plan.deadline_seconds is not None:
+        overrun += max(0.0, plan.estimated_seconds / plan.deadline_seconds - 1)
+    if plan.token_budget is not None:
+        overrun += max(0.0, plan.estimated_tokens / plan.token_budget - 1)
+    return overrun
+
+
+def _log_plan(plan: RunPlan) -> None:
+    logger.info(
+        f"Run plan: {plan.frame_count} frames, ~{plan.estimated_seconds:.1f}s, "
+        f"~{plan.estimated_tokens} tokens, degradations: {', '.join(plan.degradations) or 'none'}"
+    )
+
+
+def plan_run(
+    manifest: FrameManifest,
+    deadline_seconds: Optional[float] = None,
+    token_budget: Optional[int] = None,
+) -> Tuple[FrameManifest, RunPlan]:
+    """
+    Pick the cheapest set of degradations that fits the deadline and token
+    budget. Degradations are tried in order: low image detail, heuristic
+    events instead of LLM enhancement, fallback story synthesis, and as a
+    last resort frame subsampling (down to PLANNER_MIN_FRAMES, keeping as
+    many frames as fit); a step is only kept if it brings the estimate
+    closer to the limits. If even every
+    degradation together cannot fit, nothing is degraded and a warning is
+    logged. Returns the manifest to analyze (possibly subsampled) and the
+    plan with its estimates.
+    """
+    if deadline_seconds is None and token_budget is None:
+        return manifest, RunPlan(frame_count=len(manifest.frames))
+
+    image_sizes = [_image_size(frame) for frame in manifest.frames]
+    plan = _estimate(
+        RunPlan(deadline_seconds=deadline_seconds, token_budget=token_budget),
+        image_sizes,
+    )
+    selected = list(range(len(image_sizes)))
+    if _fits(plan):
+        _log_plan(plan)
+        return manifest, plan
+
+    min_frames = min(len(image_sizes), int(os.getenv("PLANNER_MIN_FRAMES", "3")))
+    floor = _estimate(
+        plan.model_copy(
+            update={"image_detail": "low", "use_llm_enhancement": False, "use_llm_synthesis": False},
+            deep=True,
+        ),
+        [image_sizes[i] for i in _subsample(len(image_sizes), min_frames)],
+    )
+    if not _fits(floor):
+        logger.warning(
+            f"Run cannot fit the limits even with every degradation "
+            f"(~{floor.estimated_seconds:.1f}s, ~{floor.estimated_tokens} tokens); "
+            f"running without degradations"
+        )
+        _log_plan(plan)
+        return manifest, plan
+
+    def degrade(name: str, **changes) -> None:
+        nonlocal plan
+        if _fits(plan):
+            return
+        candidate = _estimate(
+            plan.model_copy(update=changes, deep=True), [image_sizes[i] for i in selected]
+        )
+        if _overrun(candidate) < _overrun(plan):
+            candidate.degradations.append(name)
+            plan = candidate
+
+    degrade("low_image_detail", image_detail="low")
+    degrade("heuristic_events", use_llm_enhancement=False)
+    degrade("fallback_synthesis", use_llm_synthesis=False)
+
+    if not _fits(plan):
+        keep = len(image_sizes)
+        while keep > min_frames and not _fits(plan):
+            keep -= 1
+            selected = _subsample(len(image_sizes), keep)
+            _estimate(plan, [image_sizes[i] for i in selected])
+        if len(selected) < len(image_sizes):
+            plan.degradations.append(f"subsampled_frames:{len(selected)}/{len(image_sizes)}")
+
+    if not _fits(plan):
+        logger.warning(
+            f"Run plan still exceeds limits after degrading: "
+            f"~{plan.estimated_seconds:.1f}s, ~{plan.estimated_tokens} tokens"
+        )
+
+    _log_plan(plan)
+    subsampled = FrameManifest(
+        folder=manifest.folder, frames=[manifest.frames[i] for i in selected]
+    )
+    return subsampled, plan
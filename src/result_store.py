@@ -0,0 +1,317 @@
+import json
+import os
+import re
+import sqlite3
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from config.logging_config import get_logger
+
+logger = get_logger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS stories (
+    story_id INTEGER PRIMARY KEY,
+    created_at TEXT NOT NULL,
+    folder TEXT,
+    title TEXT,
+    summary TEXT,
+    story_json TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS frames (
+    story_id INTEGER NOT NULL REFERENCES stories(story_id) ON DELETE CASCADE,
+    frame_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    timestamp TEXT,
+    scene_description TEXT,
+    entities_json TEXT,
+    image_path TEXT,
+    PRIMARY KEY (story_id, frame_id)
+);
+CREATE TABLE IF NOT EXISTS entities (
+    story_id INTEGER NOT NULL REFERENCES stories(story_id) ON DELETE CASCADE,
+    entity_id TEXT NOT NULL,
+    entity_type TEXT,
+    label TEXT,
+    description TEXT,
+    first_seen TEXT,
+    frame_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (story_id, entity_id)
+);
+CREATE TABLE IF NOT EXISTS appearances (
+    story_id INTEGER NOT NULL REFERENCES stories(story_id) ON DELETE CASCADE,
+    entity_id TEXT NOT NULL,
+    frame_id TEXT NOT NULL,
+    PRIMARY KEY (story_id, entity_id, frame_id)
+);
+CREATE TABLE IF NOT EXISTS events (
+    story_id INTEGER NOT NULL REFERENCES stories(story_id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    frame_id TEXT,
+    event TEXT,
+    PRIMARY KEY (story_id, position)
+);
+CREATE INDEX IF NOT EXISTS idx_entities_type ON entities (entity_type, frame_count);
+CREATE INDEX IF NOT EXISTS idx_entities_label ON entities (label, frame_count);
+CREATE INDEX IF NOT EXISTS idx_frames_frame_id ON frames (frame_id);
+CREATE INDEX IF NOT EXISTS idx_appearances_frame ON appearances (frame_id, story_id);
+CREATE INDEX IF NOT EXISTS idx_events_frame ON events (frame_id);
+CREATE VIRTUAL TABLE IF NOT EXISTS story_text USING fts5 (
+    title, summary, characters, events, scenes
+);
+"""
+
+
+def _label(name: str) -> str:
+    """'dog_1' -> 'dog', 'Red Car 2' -> 'red car'."""
+    return re.sub(r"[\s_-]*\d+$", "", name.strip().lower()).replace("_", " ")
+
+
+class ResultStore:
+    """
+    SQLite store of generated stories with their frames, entities and events.
+    Story text (title, summary, characters, events, scene descriptions) is
+    indexed with FTS5 so stories can be looked up without rerunning the
+    pipeline.
+    """
+
+    def __init__(self, db_path: str):
+        directory = os.path.dirname(db_path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+
+        self.db_path = db_path
+        self._conn = sqlite3.connect(db_path)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA foreign_keys = ON")
+        self._conn.execute("PRAGMA journal_mode = WAL")
+        self._conn.executescript(_SCHEMA)
+
+        # Stores created before frames kept their source image lack the column
+        columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(frames)")}
+        if "image_path" not in columns:
+            self._conn.execute("ALTER TABLE frames ADD COLUMN image_path TEXT")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_frames_image_path ON frames (image_path)"
+        )
+
+    def __enter__(self) -> "ResultStore":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def save(self, result: Dict[str, Any], folder: Optional[str] = None) -> int:
+        """
+        Persist a workflow result (final_story, frame_metadata,
+        consistent_entities). Frame ids are positional, so each frame also
+        records its source image from `image_paths`, in the same order.
+        """
+        story = result.get("final_story") or "{}"
+        if isinstance(story, str):
+            story = json.loads(story)
+        frame_metadata = result.get("frame_metadata") or []
+        image_paths = result.get("image_paths") or []
+        if len(image_paths) != len(frame_metadata):
+            logger.warning(
+                f"Got {len(image_paths)} image paths for {len(frame_metadata)} frames; "
+                f"not storing source images"
+            )
+            image_paths = []
+        image_paths = [os.path.abspath(path) for path in image_paths]
+        consistent_entities = result.get("consistent_entities") or {}
+        characters = {
+            c.get("entity_id"): c for c in consistent_entities.get("characters", [])
+        }
+        events = consistent_entities.get("events", [])
+
+        # Entity appearances come from the resolved entity_id on each frame entity
+        entities: Dict[str, Dict[str, Any]] = {}
+        for frame in frame_metadata:
+            for entity in frame["entities"]:
+                entity_id = entity.get("entity_id") or entity["name"]
+                record = entities.setdefault(
+                    entity_id,
+                    {
+                        "entity_type": str(entity.get("type", "")).lower(),
+                        "label": _label(entity["name"]),
+                        "first_seen": frame["frame_id"],
+                        "frames": [],
+                    },
+                )
+                if frame["frame_id"] not in record["frames"]:
+                    record["frames"].append(frame["frame_id"])
+
+        # Characters only known to the LLM output (no frame-level entity_id)
+        for entity_id, character in characters.items():
+            if entity_id and entity_id not in entities:
+                appearances = character.get("appearances", [])
+                entities[entity_id] = {
+                    "entity_type": str(character.get("entity_type", "")).lower(),
+                    "label": _label(entity_id),
+                    "first_seen": character.get("first_seen"),
+                    "frames": list(appearances),
+                }
+
+        with self._conn:
+            cursor = self._conn.execute(
+                "INSERT INTO stories (created_at, folder, title, summary, story_json) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (
+                    datetime.now().isoformat() + "Z",
+                    folder,
+                    story.get("title"),
+                    story.get("summary"),
+                    json.dumps(story, ensure_ascii=False),
+                ),
+            )
+            story_id = cursor.lastrowid
+
+            self._conn.executemany(
+                "INSERT INTO frames (story_id, frame_id, position, timestamp, "
+                "scene_description, entities_json, image_path) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        story_id,
+                        frame["frame_id"],
+                        position,
+                        frame.get("timestamp"),
+                        frame.get("scene_description"),
+                        json.dumps(frame["entities"], ensure_ascii=False),
+                        image_paths[position] if image_paths else None,
+                    )
+                    for position, frame in enumerate(frame_metadata)
+                ],
+            )
+            self._conn.executemany(
+                "INSERT INTO entities VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        story_id,
+                        entity_id,
+                        record["entity_type"],
+                        record["label"],
+                        characters.get(entity_id, {}).get("description", record["label"]),
+                        record["first_seen"],
+                        len(record["frames"]),
+                    )
+                    for entity_id, record in entities.items()
+                ],
+            )
+            self._conn.executemany(
+                "INSERT INTO appearances VALUES (?, ?, ?)",
+                [
+                    (story_id, entity_id, frame_id)
+                    for entity_id, record in entities.items()
+                    for frame_id in record["frames"]
+                ],
+            )
+            self._conn.executemany(
+                "INSERT INTO events VALUES (?, ?, ?, ?)",
+                [
+                    (story_id, position, event.get("frame_id"), event.get("event"))
+                    for position, event in enumerate(events)
+                ],
+            )
+            self._conn.execute(
+                "INSERT INTO story_text (rowid, title, summary, characters, events, scenes) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    story_id,
+                    story.get("title", ""),
+                    story.get("summary", ""),
+                    " ".join(str(c.get("description", "")) for c in characters.values()),
+                    " ".join(
+                        [str(e.get("event_description", "")) for e in story.get("event_sequence", [])]
+                        + [str(e.get("event", "")) for e in events]
+                    ),
+                    " ".join(str(f.get("scene_description", "")) for f in frame_metadata),
+                ),
+            )
+
+        logger.info(f"Stored story {story_id} with {len(frame_metadata)} frames and {len(entities)} entities")
+        return story_id
+
+    def get_story(self, story_id: int) -> Optional[Dict[str, Any]]:
+        """Return the stored story JSON with its frames, entities and events."""
+        row = self._conn.execute(
+            "SELECT * FROM stories WHERE story_id = ?", (story_id,)
+        ).fetchone()
+        if row is None:
+            return None
+
+        frames = self._conn.execute(
+            "SELECT frame_id, image_path, timestamp, scene_description, entities_json FROM frames "
+            "WHERE story_id = ? ORDER BY position",
+            (story_id,),
+        ).fetchall()
+        entities = self._conn.execute(
+            "SELECT entity_id, entity_type, label, description, first_seen, frame_count "
+            "FROM entities WHERE story_id = ?",
+            (story_id,),
+        ).fetchall()
+        events = self._conn.execute(
+            "SELECT frame_id, event FROM events WHERE story_id = ? ORDER BY position",
+            (story_id,),
+        ).fetchall()
+
+        return {
+            "story_id": row["story_id"],
+            "created_at": row["created_at"],
+            "folder": row["folder"],
+            "story": json.loads(row["story_json"]),
+            "frames": [
+                {
+                    "frame_id": f["frame_id"],
+                    "image_path": f["image_path"],
+                    "timestamp": f["timestamp"],
+                    "scene_description": f["scene_description"],
+                    "entities": json.loads(f["entities_json"] or "[]"),
+                }
+                for f in frames
+            ],
+            "entities": [dict(e) for e in entities],
+            "events": [dict(e) for e in events],
+        }
+
+    def stories_with_entity(self, kind: str, min_frames: int = 1) -> List[Dict[str, Any]]:
+        """
+        Stories containing an entity whose type ('animal') or label ('dog')
+        matches `kind` and that appears in at least `min_frames` frames.
+        """
+        kind = kind.strip().lower()
+        rows = self._conn.execute(
+            "SELECT s.story_id, s.title, s.summary, "
+            "GROUP_CONCAT(e.entity_id) AS entity_ids, MAX(e.frame_count) AS frame_count "
+            "FROM entities e JOIN stories s ON s.story_id = e.story_id "
+            "WHERE (e.label = ? OR e.entity_type = ?) AND e.frame_count >= ? "
+            "GROUP BY s.story_id ORDER BY s.story_id",
+            (kind, kind, min_frames),
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def stories_with_frame(self, image_path: str) -> List[Dict[str, Any]]:
+        """
+        Stories that used the given source image, with the frame id it got in
+        each story and the entities seen in it (None when there were none).
+        """
+        rows = self._conn.execute(
+            "SELECT s.story_id, s.title, f.frame_id, GROUP_CONCAT(a.entity_id) AS entity_ids "
+            "FROM frames f JOIN stories s ON s.story_id = f.story_id "
+            "LEFT JOIN appearances a ON a.story_id = f.story_id AND a.frame_id = f.frame_id "
+            "WHERE f.image_path = ? GROUP BY f.story_id, f.frame_id ORDER BY s.story_id",
+            (os.path.abspath(image_path),),
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def search(self, query: str, limit: int = 20) -> List[Dict[str, Any]]:
+        """Full-text search (FTS5 query syntax) over story text, best match first."""
+        rows = self._conn.execute(
+            "SELECT s.story_id, s.title, s.summary, bm25(story_text) AS score "
+            "FROM story_text JOIN stories s ON s.story_id = story_text.rowid "
+            "WHERE story_text MATCH ? ORDER BY score LIMIT ?",
+            (query, limit),
+        ).fetchall()
+        return [dict(row) for row in rows]
@@ -1,41 +1,145 @@
+import fnmatch
 import os
+import re
 from datetime import datetime
+from typing import Dict, List, Optional, Tuple, Union
+from PIL import Image
+from models.data_models import FrameFile, FrameManifest
 from config.logging_config import get_logger
 
 logger = get_logger(__name__)
 
-def read_images_on_folder(folder_path):
-    """Reads all image files in a specified folder and returns their paths."""
+VALID_IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".gif", ".bmp", ".webp", ".tiff")
+
+# EXIF tags: DateTimeOriginal lives in the Exif sub-IFD, DateTime in IFD0
+_EXIF_IFD = 0x8769
+_EXIF_DATETIME_ORIGINAL = 36867
+_EXIF_DATETIME = 306
+
+
+def _natural_key(text: str) -> List[Union[int, str]]:
+    """Sort key that orders 'frame_2' before 'frame_10'."""
+    return [int(part) if part.isdigit() else part.lower() for part in re.split(r"(\d+)", text)]
 
-    image_paths = []
-    valid_extensions = (".jpg", ".jpeg", ".png", ".gif", ".bmp", ".webp", ".tiff")
 
+def _read_image_header(path: str) -> Tuple[Optional[str], Optional[Tuple[int, int]]]:
+    """
+    Read the EXIF capture time and the image size from the image header,
+    without decoding pixels. Either is None when it cannot be read.
+    """
+    size = None
+    try:
+        with Image.open(path) as image:
+            size = image.size
+            exif = image.getexif()
+            value = exif.get_ifd(_EXIF_IFD).get(_EXIF_DATETIME_ORIGINAL) or exif.get(
+                _EXIF_DATETIME
+            )
+        if not value:
+            return None, size
+        capture_time = datetime.strptime(str(value).strip(), "%Y:%m:%d %H:%M:%S")
+        return capture_time.isoformat() + "Z", size
+    except Exception as e:
+        logger.debug("No EXIF capture time for %s: %s", path, e)
+        return None, size
+
+
+def _capture_seconds(frame: FrameFile) -> float:
+    """Capture time as a POSIX timestamp, falling back to the modification time."""
+    if frame.capture_time:
+        return datetime.fromisoformat(frame.capture_time.rstrip("Z")).timestamp()
+    return frame.mtime
+
+
+def scan_frames(
+    folder_path: str,
+    pattern: Optional[str] = None,
+    recursive: bool = False,
+    order: str = "name",
+) -> FrameManifest:
+    """
+    Scan a folder once with os.scandir and return a manifest of image frames.
+
+    Size and modification time come from the directory entries, so frames are
+    not stat-ed again downstream. `pattern` is a glob matched against the path
+    relative to the folder (default: known image extensions). `order` is
+    'name' (natural filename order), 'mtime', or 'exif' (capture time read
+    from the image header, falling back to mtime; the image size from the
+    same read is kept for the planner).
+    """
     if not os.path.isdir(folder_path):
         logger.error(f"The folder at '{folder_path}' does not exist.")
-        return image_paths
+        return FrameManifest(folder=folder_path)
 
-    for filename in os.listdir(folder_path):
-        # Check if the file has a valid image extension
-        if filename.lower().endswith(valid_extensions):
-            full_path = os.path.join(folder_path, filename)
-            image_paths.append(full_path)
+    entries = []
+    pending = [folder_path]
+    while pending:
+        current = pending.pop()
+        try:
+            iterator = os.scandir(current)
+        except OSError as e:
+            logger.warning(f"Skipping unreadable folder {current}: {e}")
+            continue
 
-    logger.info(f"Found {len(image_paths)} image files in {folder_path}")
-    return image_paths
+        with iterator:
+            for entry in iterator:
+                # Symlinked folders are not followed, so link loops cannot recurse forever
+                if entry.is_dir(follow_symlinks=False):
+                    if recursive:
+                        pending.append(entry.path)
+                    continue
+                if not entry.is_file():
+                    continue
 
+                relative_path = os.path.relpath(entry.path, folder_path)
+                if pattern:
+                    if not fnmatch.fnmatch(relative_path, pattern):
+                        continue
+                elif not entry.name.lower().endswith(VALID_IMAGE_EXTENSIONS):
+                    continue
 
-def get_file_timestamp(file_path):
-    """Get timestamp from file metadata or use current time as fallback."""
-    try:
-        # Get the file modification time
-        stat = os.stat(file_path)
-        timestamp = datetime.fromtimestamp(stat.st_mtime)
-    except Exception as e:
-        # Fallback to current time
-        logger.warning(f"Could not get file timestamp for {file_path}: {e}. Using current time.")
-        timestamp = datetime.now()
+                try:
+                    stat = entry.stat()
+                except OSError as e:
+                    logger.warning(f"Skipping {entry.path}: {e}")
+                    continue
+                entries.append(
+                    (
+                        relative_path,
+                        FrameFile(path=entry.path, size=stat.st_size, mtime=stat.st_mtime),
+                    )
+                )
 
-    return timestamp.isoformat() + "Z"
+    if order == "exif":
+        for _, frame in entries:
+            frame.capture_time, frame.image_size = _read_image_header(frame.path)
+        # Compare numerically: EXIF times have no fraction of a second, mtimes do
+        entries.sort(key=lambda item: (_capture_seconds(item[1]), _natural_key(item[0])))
+    elif order == "mtime":
+        entries.sort(key=lambda item: (item[1].mtime, _natural_key(item[0])))
+    else:
+        entries.sort(key=lambda item: _natural_key(item[0]))
+
+    logger.info(f"Found {len(entries)} image files in {folder_path}")
+    return FrameManifest(folder=folder_path, frames=[frame for _, frame in entries])
+
+
+def manifest_from_paths(image_paths: List[str]) -> FrameManifest:
+    """Build a manifest for an explicit list of paths, keeping their order."""
+    frames = []
+    for path in image_paths:
+        try:
+            stat = os.stat(path)
+            frames.append(FrameFile(path=path, size=stat.st_size, mtime=stat.st_mtime))
+        except OSError as e:
+            logger.warning(f"Could not stat {path}: {e}. Using current time.")
+            frames.append(FrameFile(path=path, size=0, mtime=datetime.now().timestamp()))
+    return FrameManifest(folder=os.path.commonpath(image_paths) if image_paths else "", frames=frames)
+
+
+def read_images_on_folder(folder_path):
+    """Reads all image files in a specified folder and returns their paths in natural order."""
+    return scan_frames(folder_path).paths
 
 
 def clean_json_text(text: str) -> str:
@@ -48,3 +152,45 @@ def clean_json_text(text: str) -> str:
     if content.endswith("```"):
         content = content[:-3]  # Remove ```
     return content.strip()
+
+
+def get_token_usage(message) -> Dict[str, int]:
+    """Extract input/cached/output token counts from an LLM response message."""
+    usage = getattr(message, "usage_metadata", None) or {}
+    input_tokens = usage.get("input_tokens", 0)
+    output_tokens = usage.get("output_tokens", 0)
+    cached_tokens = (usage.get("input_token_details") or {}).get("cache_read", 0)
+
+    # Older integrations only expose the raw OpenAI usage block
+    if not usage:
+        token_usage = (getattr(message, "response_metadata", None) or {}).get(
+            "token_usage"
+        ) or {}
+        input_tokens = token_usage.get("prompt_tokens", 0)
+        output_tokens = token_usage.get("completion_tokens", 0)
+        cached_tokens = (token_usage.get("prompt_tokens_details") or {}).get(
+            "cached_tokens", 0
+        )
+
+    cached_tokens = cached_tokens or 0
+    return {
+        "input_tokens": input_tokens,
+        "cached_input_tokens": cached_tokens,
+        "uncached_input_tokens": input_tokens - cached_tokens,
+        "output_tokens": output_tokens,
+    }
+
+
+def log_token_usage(stage: str, prompt_version: str, message) -> Dict[str, int]:
+    """Log cached vs. uncached input tokens for an LLM call and return the counts."""
+    usage = get_token_usage(message)
+    logger.info(
+        "%s token usage (prompt %s): input=%d cached=%d uncached=%d output=%d",
+        stage,
+        prompt_version,
+        usage["input_tokens"],
+        usage["cached_input_tokens"],
+        usage["uncached_input_tokens"],
+        usage["output_tokens"],
+    )
+    return usage